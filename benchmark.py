@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+# Benchmarks for every pipeline stage on deterministic synthetic CT data.
+# Each stage runs in a fresh (spawned) process so peak RSS is its own.
+#
+#   python benchmark.py --rows 1000000
+#   python benchmark.py --rows 1000000 --json today.json --baseline last.json
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Public suffixes with a rough CT-log skew (weights), most traffic under .com
+SUFFIXES = [('com', 45), ('net', 8), ('org', 6), ('de', 5), ('co.uk', 4), ('xyz', 3), ('io', 3), ('ru', 3),
+            ('com.au', 2), ('nl', 2), ('fr', 2), ('jp', 2), ('info', 2), ('online', 1), ('xn--p1ai', 1),
+            ('blogspot.com', 1), ('dev', 1), ('app', 1), ('co', 1), ('shop', 1)]
+PREFIXES = [('', 50), ('www.', 25), ('*.', 12), ('mail.', 4), ('api.', 3), ('cdn.', 2), ('dev.', 2), ('a.b.', 2)]
+WORDS = ['red', 'pill', 'redpill', 'incel', 'mrp', 'pua', 'coach', 'dating', 'alpha', 'blog', 'shop', 'cloud',
+         'home', 'my', 'best', 'news', 'tech', 'game', 'web', 'app', 'data', 'secure', 'online', 'world']
+
+STAGES = ['step3', 'tokenization', 'one', 'frequency', 'remwords']
+# Input each stage reads, relative to the data directory; its rows are what
+# rows/s is computed from
+STAGE_INPUTS = {'step3': os.path.join('step3', 'com', 'part-0.csv'), 'tokenization': os.path.join('ct', 'ct-0.csv'),
+                'one': os.path.join('psl', 'dot_com.csv'), 'frequency': os.path.join('ones', 'com_names.csv'),
+                'remwords': os.path.join('frequency', 'com_names_freq.csv')}
+
+class Generator:
+    def __init__(self, seed=0, vocabulary=200000):
+        self.random = random.Random(seed)
+        self.vocabulary = vocabulary
+        self.suffixes, self.suffix_weights = zip(*SUFFIXES)
+        self.prefixes, self.prefix_weights = zip(*PREFIXES)
+
+    # Registrable labels are Zipf-distributed over the vocabulary, so popular
+    # names repeat the way they do in CT logs
+    def label(self):
+        rank = int(self.vocabulary ** self.random.random())
+        words = WORDS[rank % len(WORDS)], WORDS[(rank // len(WORDS)) % len(WORDS)]
+        return f"{words[0]}{words[1]}{rank}" if rank > len(WORDS) else words[0]
+
+    def dns_name(self):
+        prefix = self.random.choices(self.prefixes, self.prefix_weights)[0]
+        suffix = self.random.choices(self.suffixes, self.suffix_weights)[0]
+        return prefix, self.label(), suffix
+
+    def timestamp(self):
+        return 1500000000 + self.random.randrange(250000000)
+
+# Write rows to path in blocks; row(generator) returns one CSV line
+def write_rows(path, rows, row, seed):
+    generator = Generator(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        block = []
+        for _ in range(rows):
+            block.append(row(generator))
+            if len(block) >= 100000:
+                file.write(''.join(block))
+                block = []
+        file.write(''.join(block))
+
+def cname_row(generator):
+    prefix, label, suffix = generator.dns_name()
+    return f"{prefix}{label}.{suffix},{generator.timestamp()}\n"
+
+def dns_row(generator):
+    prefix, label, suffix = generator.dns_name()
+    first = generator.timestamp()
+    return f"{prefix}{label}.{suffix},{first},{first + generator.random.randrange(90 * 86400)}\n"
+
+def bucket_row(generator):
+    prefix, label, suffix = generator.dns_name()
+    first = generator.timestamp()
+    return f"{prefix}{label},{first},{first + generator.random.randrange(90 * 86400)}\n"
+
+def ones_row(generator):
+    return f"{generator.label()},{generator.timestamp()},{generator.timestamp()}\n"
+
+# Generate the input of every stage under data_dir
+def generate(data_dir, rows, seed=0):
+    write_rows(os.path.join(data_dir, 'step3', 'com', 'part-0.csv'), rows, cname_row, seed)
+    write_rows(os.path.join(data_dir, 'ct', 'ct-0.csv'), rows, dns_row, seed + 1)
+    write_rows(os.path.join(data_dir, 'psl', 'dot_com.csv'), rows, bucket_row, seed + 2)
+    write_rows(os.path.join(data_dir, 'ones', 'com_names.csv'), rows, ones_row, seed + 3)
+    # remwords reads name,freq counts, which is frequency's output
+    sys.path.insert(0, REPO_DIR)
+    import frequency
+    os.makedirs(os.path.join(data_dir, 'frequency'), exist_ok=True)
+    frequency.process_files(os.path.join(data_dir, 'ones'), os.path.join(data_dir, 'frequency'), incremental=False)
+
+def count_rows(path):
+    with open(path, 'rb') as file:
+        return sum(1 for line in file)
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(path) for name in files)
+
+# Run one stage on the generated data; returns the path of its output
+def run_stage(stage, data_dir, out_dir):
+    sys.path.insert(0, REPO_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    if stage == 'step3':
+        import step3
+        # process_file logs errors (to process.log) and returns False instead of raising
+        if not step3.process_file(os.path.join(data_dir, 'step3', 'com', 'part-0.csv'), out_dir,
+                                  os.path.join(out_dir, 'checkpoint.txt'), os.path.join(out_dir, 'lockfile.lck')):
+            raise RuntimeError("step3 failed, see process.log")
+    elif stage == 'tokenization':
+        import tokenization
+        tokenization.process_csv(os.path.join(data_dir, 'ct', 'ct-0.csv'), out_dir)
+    elif stage == 'one':
+        import one
+        error_log_path = os.path.join(out_dir, 'error_log.txt')
+        if not one.process_file(os.path.join(data_dir, 'psl', 'dot_com.csv'), out_dir, error_log_path):
+            with open(error_log_path) as error_log:
+                raise RuntimeError(f"one failed: {error_log.read().strip()}")
+    elif stage == 'frequency':
+        import frequency
+        frequency.process_files(os.path.join(data_dir, 'ones'), out_dir, incremental=False)
+    elif stage == 'remwords':
+        import remwords
+        remwords.filter_and_save_csv(os.path.join(data_dir, 'frequency', 'com_names_freq.csv'),
+                                     os.path.join(out_dir, 'com_names_freq.csv'), remwords.FORBIDDEN_WORDS)
+    return out_dir
+
+def _stage_worker(stage, data_dir, out_dir, queue):
+    start = time.perf_counter()
+    run_stage(stage, data_dir, out_dir)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+
+def measure(stage, data_dir):
+    rows = count_rows(os.path.join(data_dir, STAGE_INPUTS[stage]))
+    out_dir = tempfile.mkdtemp(prefix=f'bench-{stage}-', dir=data_dir)
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_stage_worker, args=(stage, data_dir, out_dir, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{stage} benchmark failed with exit code {process.exitcode}")
+    elapsed, peak_rss = queue.get()
+    result = {'stage': stage, 'rows': rows, 'seconds': elapsed, 'rows_per_s': rows / elapsed,
+              'peak_rss': peak_rss, 'output_bytes': dir_size(out_dir)}
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return result
+
+# Go equivalent of tokenization, when a Go toolchain is available and the
+# module builds (it needs golang.org/x/net from the module proxy)
+# Read a process's output up to and including prompt
+def read_until(stream, prompt):
+    seen = ''
+    while not seen.endswith(prompt):
+        char = stream.read(1)
+        if not char:
+            raise RuntimeError(f"classify-tokens exited before prompting {prompt.strip()!r}")
+        seen += char
+    return seen
+
+def measure_go(data_dir):
+    go = shutil.which('go')
+    if go is None:
+        return None
+    binary = os.path.join(data_dir, 'classify-tokens')
+    build = subprocess.run([go, 'build', '-o', binary, '.'], cwd=os.path.join(REPO_DIR, 'go-code'),
+                           capture_output=True, text=True)
+    if build.returncode != 0:
+        print(f"Skipping Go classify-tokens: build failed\n{build.stderr.strip()}")
+        return None
+    rows = count_rows(os.path.join(data_dir, STAGE_INPUTS['tokenization']))
+    out_dir = tempfile.mkdtemp(prefix='bench-go-', dir=data_dir)
+    process = subprocess.Popen([binary], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    # Each prompt reads stdin through a fresh bufio.Reader, so answer them one
+    # at a time or the first reader swallows both lines: the second prompt is
+    # only printed once the first answer has been read. The run starts with
+    # the second answer.
+    process.stdin.write(os.path.join(data_dir, 'ct') + '\n')
+    process.stdin.flush()
+    read_until(process.stdout, 'Enter the output directory: ')
+    start = time.perf_counter()
+    process.stdin.write(out_dir + '\n')
+    process.stdin.close()
+    process.stdout.read()
+    # RUSAGE_CHILDREN would be the maximum over every child waited for so far
+    # (go build, the Python stages), so take this process's own usage
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    peak_rss = usage.ru_maxrss * 1024
+    result = {'stage': 'tokenization (go)', 'rows': rows, 'seconds': elapsed, 'rows_per_s': rows / elapsed,
+              'peak_rss': peak_rss, 'output_bytes': dir_size(out_dir)}
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return result
+
+def print_results(results):
+    print(f"{'stage':<20}{'rows':>12}{'seconds':>10}{'rows/s':>14}{'peak RSS MiB':>14}{'output MiB':>12}")
+    for result in results:
+        print(f"{result['stage']:<20}{result['rows']:>12}{result['seconds']:>10.2f}{result['rows_per_s']:>14.0f}"
+              f"{result['peak_rss'] / 2 ** 20:>14.1f}{result['output_bytes'] / 2 ** 20:>12.1f}")
+
+# Stages whose throughput fell, or whose peak RSS grew, by more than tolerance
+def regressions(results, baseline, tolerance):
+    previous = {result['stage']: result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get(result['stage'])
+        if before is None or before['rows'] != result['rows']:
+            continue
+        if result['rows_per_s'] < before['rows_per_s'] * (1 - tolerance):
+            found.append(f"{result['stage']}: {before['rows_per_s']:.0f} -> {result['rows_per_s']:.0f} rows/s")
+        if result['peak_rss'] > before['peak_rss'] * (1 + tolerance):
+            found.append(f"{result['stage']}: peak RSS {before['peak_rss'] >> 20} -> {result['peak_rss'] >> 20} MiB")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic CT data.")
+    parser.add_argument('--rows', type=int, default=100000, help="rows per generated input (1e5 to 1e8)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--data-dir', help="keep generated data here (default: a temporary directory)")
+    parser.add_argument('--no-go', action='store_true', help="skip the Go classify-tokens comparison")
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--baseline', help="results file of an earlier run to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative slowdown / RSS growth")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ct-bench-')
+    # Keep the stages' own metrics records out of the working directory
+    os.environ['CT_METRICS'] = os.path.join(data_dir, 'metrics.jsonl')
+    try:
+        if not os.path.exists(os.path.join(data_dir, 'ct', 'ct-0.csv')):
+            print(f"Generating {args.rows} rows per input in {data_dir}...")
+            generate(data_dir, args.rows, args.seed)
+        results = [measure(stage, data_dir) for stage in args.stages]
+        if not args.no_go and 'tokenization' in args.stages:
+            go_result = measure_go(data_dir)
+            if go_result is not None:
+                results.append(go_result)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+from collections import defaultdict
+import stageio
+import manifest
+import frequency
+import remwords
+import forbidden
+
+# Persistent per-TLD name counts that new CT snapshots are folded into.
+# Each TLD gets one SQLite file holding the raw first-label counts (as
+# produced by frequency.py) and the forbidden-word filtered counts (as
+# produced by remwords.py). Both are sums over rows, so a delta only has to
+# be added, and the sorted top-N view is read back from an index.
+RAW = 'counts'
+FILTERED = 'filtered'
+
+class CountStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for table in (RAW, FILTERED):
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (name TEXT PRIMARY KEY, freq INTEGER NOT NULL) WITHOUT ROWID")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_by_freq ON {table} (freq DESC, name)")
+        # Deltas already added, keyed by content hash, so re-ingesting a file is a no-op
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ingested (source TEXT PRIMARY KEY, path TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def is_ingested(self, source):
+        return self.conn.execute("SELECT 1 FROM ingested WHERE source = ?", (source,)).fetchone() is not None
+
+    def _add(self, table, counts):
+        self.conn.executemany(
+            f"INSERT INTO {table} (name, freq) VALUES (?, ?) "
+            f"ON CONFLICT (name) DO UPDATE SET freq = freq + excluded.freq",
+            counts.items())
+
+    # Fold one delta into the raw and filtered counts in a single transaction
+    def add_delta(self, raw_counts, filtered_counts, source, path=None):
+        with self.conn:
+            if self.is_ingested(source):
+                return False
+            self._add(RAW, raw_counts)
+            self._add(FILTERED, filtered_counts)
+            self.conn.execute("INSERT INTO ingested (source, path) VALUES (?, ?)", (source, path))
+        return True
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    # Recompute the filtered counts from the stored raw counts, e.g. after the
+    # forbidden-word list changed. Only this TLD's distinct names are read.
+    def refilter(self, forbidden_words, params_digest):
+        filtered_counts = filter_counts(self.items(RAW), forbidden_words)
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {FILTERED}")
+            self._add(FILTERED, filtered_counts)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('filter', ?)", (params_digest,))
+
+    def items(self, table=RAW):
+        return self.conn.execute(f"SELECT name, freq FROM {table}")
+
+    # Names by descending frequency, optionally only the first n
+    def top(self, n=None, table=FILTERED):
+        query = f"SELECT name, freq FROM {table} ORDER BY freq DESC, name"
+        if n is not None:
+            return self.conn.execute(query + " LIMIT ?", (n,))
+        return self.conn.execute(query)
+
+# remwords aggregation over (name, freq) pairs
+def filter_counts(name_frequency, forbidden_words):
+    matcher = forbidden.as_matcher(forbidden_words)
+    filtered_data = defaultdict(int)
+    for name, freq in name_frequency:
+        for filtered_name in remwords.filter_tokens(str(name), matcher):
+            filtered_data[filtered_name] += freq
+    return filtered_data
+
+# Add a ones/-style delta file (e.g. the output of one.py on a new snapshot)
+# to the store of its TLD and refresh the top-N filtered view
+def ingest_file(input_file_path, store_dir, view_dir, forbidden_words, top_n=None, output_format='csv'):
+    tld = os.path.basename(input_file_path).split('_')[0]
+    matcher = forbidden.as_matcher(forbidden_words)
+    filter_digest = manifest.params_digest({'forbidden_words': set(matcher.words)})
+
+    with CountStore(os.path.join(store_dir, f"{tld}.sqlite")) as store:
+        refiltered = store.get_meta('filter') != filter_digest
+        if refiltered:
+            store.refilter(matcher, filter_digest)
+        # The delta is hashed while it is counted, so it is only read once;
+        # the counts are dropped if the store already holds it
+        digest = manifest.content_digest()
+        raw_counts = frequency.count_name_frequency(input_file_path, digest=digest)
+        source = digest.hexdigest()
+        added = not store.is_ingested(source)
+        if added:
+            store.add_delta(raw_counts, filter_counts(raw_counts.items(), matcher), source,
+                            os.path.abspath(input_file_path))
+        if added or refiltered:
+            write_view(store, stageio.output_path(view_dir, f"{tld}_names_freq", output_format), top_n)
+    return added
+
+# Write the sorted name,freq view, same shape as remwords' output
+def write_view(store, output_file_path, top_n=None):
+    with stageio.open_writer(output_file_path, remwords.COLUMNS, encoding='latin-1') as writer:
+        writer.writerows(store.top(top_n))
+
+def ingest_directory(input_dir, store_dir, view_dir, forbidden_words=remwords.FORBIDDEN_WORDS, top_n=None,
+                     output_format='csv'):
+    os.makedirs(store_dir, exist_ok=True)
+    os.makedirs(view_dir, exist_ok=True)
+    matcher = forbidden.as_matcher(forbidden_words)
+    for filename in os.listdir(input_dir):
+        if stageio.is_stage_file(filename):
+            if ingest_file(os.path.join(input_dir, filename), store_dir, view_dir, matcher, top_n, output_format):
+                print(f"Added {filename} to the count store.")
+
+def main():
+    input_dir = 'ones_delta'  # one.py output for the new snapshot only
+    store_dir = 'counts'  # Persistent per-TLD count stores
+    view_dir = 'filtered_sorted'  # Refreshed name,freq views
+    top_n = None  # Limit the views to the N most frequent names
+    ingest_directory(input_dir, store_dir, view_dir, top_n=top_n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+from collections import deque
+
+# Forbidden-word list shared by remwords, modwords and the fused pipeline
+FORBIDDEN_WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'forbidden_words.txt')
+
+# Read one word per line; blank lines and '#' comments are ignored
+def load_words(path=FORBIDDEN_WORDS_FILE):
+    words = set()
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            word = line.split('#', 1)[0].strip().lower()
+            if word:
+                words.add(word)
+    return words
+
+# Aho-Corasick automaton answering "does the text contain any of the words as
+# a substring", i.e. any(word in text for word in words), in one pass over text.
+# Failure links are folded into a full transition table, so matching is one
+# dict lookup per character.
+class SubstringMatcher:
+    def __init__(self, words):
+        self.words = frozenset(words)
+        goto = [{}]
+        accepting = [False]
+        for word in self.words:
+            state = 0
+            for ch in word:
+                if ch not in goto[state]:
+                    goto.append({})
+                    accepting.append(False)
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            accepting[state] = True
+
+        alphabet = {ch for word in self.words for ch in word}
+        # The empty word is a substring of everything
+        self.match_all = '' in self.words
+        delta = [dict() for _ in goto]
+        fail = [0] * len(goto)
+        # Breadth-first, so a state's failure target is complete before it is used
+        queue = deque()
+        for ch in alphabet:
+            target = goto[0].get(ch, 0)
+            delta[0][ch] = target
+            if target:
+                queue.append(target)
+        while queue:
+            state = queue.popleft()
+            accepting[state] = accepting[state] or accepting[fail[state]]
+            for ch in alphabet:
+                target = goto[state].get(ch)
+                if target is None:
+                    delta[state][ch] = delta[fail[state]][ch]
+                else:
+                    fail[target] = delta[fail[state]][ch]
+                    delta[state][ch] = target
+                    queue.append(target)
+        self.delta = delta
+        self.accepting = accepting
+
+    def search(self, text):
+        if self.match_all:
+            return True
+        delta = self.delta
+        accepting = self.accepting
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if accepting[state]:
+                return True
+        return False
+
+    __contains__ = search
+
+_default_matcher = None
+
+# Matcher for the shared forbidden-word list, compiled once per process
+def default_matcher():
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = SubstringMatcher(load_words())
+    return _default_matcher
+
+# Matcher for a word collection, reusing an already compiled one
+def as_matcher(words):
+    if isinstance(words, SubstringMatcher):
+        return words
+    return SubstringMatcher(words)
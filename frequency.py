@@ -1,44 +1,86 @@
 import os
-import csv
+import stageio
+from manifest import Manifest
+from heavyhitters import SpaceSaving
+import metrics
+
+# Columns of the frequency/ outputs
+COLUMNS = [('name', stageio.LABEL), ('freq', stageio.INT)]
+# Approximate (top_k) outputs add the maximum over-estimate of each count
+APPROX_COLUMNS = COLUMNS + [('error', stageio.INT)]
+
+recorder = metrics.Recorder('frequency')
+
+# Exact counts as a dict, or with top_k a bounded-memory SpaceSaving summary
+# of the top_k most frequent names (for word clouds and trends only). With
+# digest (a hashlib object), the file is hashed as it is counted.
+def count_name_frequency(file_path, top_k=None, digest=None):
+    if top_k is not None:
+        summary = SpaceSaving(top_k)
+        with stageio.open_reader(file_path, digest=digest) as reader:
+            for row in reader:
+                summary.update(row[0])
+        return summary
+
+    # Columnar inputs are counted straight from the memory-mapped column
+    if stageio.is_columnar(file_path):
+        import pyarrow.compute as pc
+        counts = pc.value_counts(stageio.read_table(file_path, digest).column(0))
+        return dict(zip(counts.field('values').to_pylist(), counts.field('counts').to_pylist()))
 
-def count_name_frequency(file_path):
     name_frequency = {}
-    
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
+
+    with stageio.open_reader(file_path, digest=digest) as reader:
         for row in reader:
             name = row[0]
             if name in name_frequency:
                 name_frequency[name] += 1
             else:
                 name_frequency[name] = 1
-    
+
     return name_frequency
 
-def process_files(input_dir, output_dir):
+# With incremental=True, inputs unchanged since the last run are skipped
+def process_files(input_dir, output_dir, output_format='csv', incremental=True, top_k=None):
     # Ensure output directory exists
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
+    manifest = Manifest(output_dir)
+    params = None if top_k is None else {'top_k': top_k}
+
     # Iterate over each file in the input directory
     for filename in os.listdir(input_dir):
-        if filename.endswith(".csv"):
+        if stageio.is_stage_file(filename):
             input_file_path = os.path.join(input_dir, filename)
-            output_filename = f"{os.path.splitext(os.path.basename(input_file_path))[0].split('_')[0]}_names_freq.csv"
-            output_file_path = os.path.join(output_dir, output_filename)
-            
-            name_frequency = count_name_frequency(input_file_path)
-            
-            # Write results to output CSV file
-            with open(output_file_path, 'w', newline='') as output_file:
-                writer = csv.writer(output_file)
-                for name, frequency in name_frequency.items():
-                    writer.writerow([name, frequency])
+            output_filename = f"{stageio.stem(input_file_path).split('_')[0]}_names_freq"
+            output_file_path = stageio.output_path(output_dir, output_filename, output_format)
+            if incremental and manifest.is_current(output_file_path, [input_file_path], params):
+                continue
+
+            with recorder.file(input_file_path, top_k=top_k) as run:
+                name_frequency = count_name_frequency(input_file_path, top_k=top_k)
+
+                # Write results to output file
+                if top_k is not None:
+                    with stageio.open_writer(output_file_path, APPROX_COLUMNS) as writer:
+                        writer.writerows(name_frequency.items())
+                    run.rows_in = name_frequency.total
+                else:
+                    with stageio.open_writer(output_file_path, COLUMNS) as writer:
+                        for name, frequency in name_frequency.items():
+                            writer.writerow([name, frequency])
+                    run.rows_in = sum(name_frequency.values())
+                run.rows_out = len(name_frequency)
+                run.wrote(output_file_path)
+            manifest.record(output_file_path, [input_file_path], params)
+            manifest.save()
 
 def main():
     input_dir = 'ones'  # Update with your input directory
     output_dir = 'frequency'  # Update with your output directory
-    process_files(input_dir, output_dir)
+    output_format = 'csv'  # or 'arrow' for columnar intermediates
+    top_k = None  # e.g. 100000 for bounded-memory approximate counts with an error column
+    process_files(input_dir, output_dir, output_format=output_format, top_k=top_k)
 
 if __name__ == "__main__":
     main()
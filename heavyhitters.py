@@ -0,0 +1,50 @@
+import heapq
+
+# Space-Saving top-k summary (Metwally et al.) with weighted updates.
+# At most `capacity` names are tracked. For every tracked name the reported
+# count over-estimates the true count by at most its error, and every name
+# whose true count exceeds total / capacity is guaranteed to be tracked.
+class SpaceSaving:
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Min-heap of (count, name). Entries may be stale (count lower than the
+        # current one) and are refreshed lazily when they reach the top.
+        self.heap = []
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def update(self, name, count=1):
+        self.total += count
+        counts = self.counts
+        if name in counts:
+            counts[name] += count
+            return
+        if len(counts) < self.capacity:
+            counts[name] = count
+            self.errors[name] = 0
+            heapq.heappush(self.heap, (count, name))
+            return
+        # Replace the name with the smallest count
+        heap = self.heap
+        while True:
+            stored, victim = heap[0]
+            current = counts[victim]
+            if stored == current:
+                break
+            heapq.heapreplace(heap, (current, victim))
+        del counts[victim]
+        del self.errors[victim]
+        counts[name] = current + count
+        self.errors[name] = current
+        heapq.heapreplace(heap, (current + count, name))
+
+    # (name, estimated count, max over-estimate) by descending estimate
+    def items(self):
+        return sorted(((name, count, self.errors[name]) for name, count in self.counts.items()),
+                      key=lambda item: item[1], reverse=True)
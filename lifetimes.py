@@ -0,0 +1,191 @@
+import os
+import json
+import itertools
+import numpy as np
+import pandas as pd
+import stageio
+from manifest import Manifest, atomic_write_text
+
+# Time-range index over step3's cname;firstseen;lastseen outputs. Each TLD
+# gets a directory of .npy arrays that are memory-mapped on load:
+#   first.npy   firstseen epochs (int64 seconds), sorted ascending
+#   last.npy    lastseen epochs, aligned with first.npy
+#   last_sorted.npy  lastseen epochs sorted ascending (for counting)
+#   names.bin / offsets.npy  cnames in first.npy order, as one UTF-8 blob
+# A cname found in several step3 files of a TLD is indexed once, with its
+# earliest firstseen and latest lastseen. A range query is a binary search on first.npy plus a vectorized check of
+# last.npy over the matching prefix, so nothing is re-parsed.
+ARRAYS = ('first', 'last', 'last_sorted', 'offsets')
+META_NAME = 'meta.json'
+# Lines of a step3 file parsed at once
+CHUNK_LINES = 1000000
+
+# Epoch seconds of an int, string or datetime-like value
+def to_epoch(value):
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    return int(pd.Timestamp(value).timestamp())
+
+# Lifetimes of a chunk of step3 lines as a frame of int64 epochs indexed by
+# cname, plus the number of rows with an unparseable time (NaT)
+def parse_lines(lines):
+    fields = pd.Series(lines, dtype=object).str.rstrip('\r\n').str.rsplit(';', n=2, expand=True)
+    if fields.shape[1] < 3:
+        return pd.DataFrame({'first': [], 'last': []}, dtype=np.int64), len(lines)
+    first = pd.to_datetime(fields[1], format='ISO8601', errors='coerce')
+    last = pd.to_datetime(fields[2], format='ISO8601', errors='coerce')
+    valid = (first.notna() & last.notna()).to_numpy()
+    frame = pd.DataFrame({'first': first.to_numpy(dtype='datetime64[s]')[valid].astype(np.int64),
+                          'last': last.to_numpy(dtype='datetime64[s]')[valid].astype(np.int64)},
+                         index=fields[0].to_numpy()[valid])
+    return frame, int((~valid).sum())
+
+# One row per cname: earliest firstseen, latest lastseen
+def merge_lifetimes(frames):
+    return pd.concat(frames).groupby(level=0, sort=False).agg({'first': 'min', 'last': 'max'})
+
+# (cnames, firstseen, lastseen) of step3 output files, one entry per cname.
+# Files are read chunk_lines at a time and reduced as they go, so memory
+# grows with the distinct cnames rather than with the rows.
+def read_lifetimes(paths, chunk_lines=CHUNK_LINES):
+    merged = None
+    pending = []
+    pending_rows = 0
+    dropped = 0
+    for path in paths:
+        with stageio.open_text(path) as file:
+            while True:
+                lines = list(itertools.islice(file, chunk_lines))
+                if not lines:
+                    break
+                frame, bad = parse_lines(lines)
+                dropped += bad
+                pending.append(frame)
+                pending_rows += len(frame)
+                # Merge once the pending rows outgrow the merged ones, so each
+                # row takes part in a logarithmic number of merges
+                if pending_rows >= max(chunk_lines, 0 if merged is None else len(merged)):
+                    merged = merge_lifetimes(pending if merged is None else [merged] + pending)
+                    pending, pending_rows = [], 0
+    if pending:
+        merged = merge_lifetimes(pending if merged is None else [merged] + pending)
+    if merged is None:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), dropped
+    return (merged.index.to_numpy(dtype=object), merged['first'].to_numpy(dtype=np.int64),
+            merged['last'].to_numpy(dtype=np.int64), dropped)
+
+def _save_array(path, array):
+    tmp_path = stageio.temp_path_for(path)
+    with open(tmp_path, 'wb') as file:
+        np.save(file, array)
+    os.replace(tmp_path, path)
+
+# Write the index of one TLD. meta.json is written last, so an index that
+# was interrupted half-way is rebuilt by the next run.
+def write_tld_index(tld_index_dir, names, first, last, dropped=0):
+    os.makedirs(tld_index_dir, exist_ok=True)
+    meta_path = os.path.join(tld_index_dir, META_NAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    order = np.argsort(first, kind='stable')
+    names = names[order]
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+    blob_path = os.path.join(tld_index_dir, 'names.bin')
+    tmp_path = stageio.temp_path_for(blob_path)
+    with open(tmp_path, 'wb') as file:
+        file.write(b''.join(encoded))
+    os.replace(tmp_path, blob_path)
+    arrays = {'first': first[order], 'last': last[order], 'last_sorted': np.sort(last), 'offsets': offsets}
+    for name in ARRAYS:
+        _save_array(os.path.join(tld_index_dir, f"{name}.npy"), arrays[name])
+    atomic_write_text(meta_path, json.dumps({'names': len(names), 'dropped': dropped}))
+
+# Index every TLD directory of step3's output. TLDs whose files are unchanged
+# since the last build are skipped.
+def build_index(step3_output_dir, index_dir, incremental=True):
+    os.makedirs(index_dir, exist_ok=True)
+    manifest = Manifest(index_dir)
+    for tld in sorted(os.listdir(step3_output_dir)):
+        tld_path = os.path.join(step3_output_dir, tld)
+        if not os.path.isdir(tld_path):
+            continue
+        paths = sorted(os.path.join(tld_path, filename) for filename in os.listdir(tld_path)
+                       if stageio.is_csv(filename))
+        tld_index_dir = os.path.join(index_dir, tld)
+        if (incremental and manifest.is_current(tld_index_dir, paths)
+                and os.path.exists(os.path.join(tld_index_dir, META_NAME))):
+            continue
+        names, first, last, dropped = read_lifetimes(paths)
+        write_tld_index(tld_index_dir, names, first, last, dropped)
+        manifest.record(tld_index_dir, paths)
+        manifest.save()
+
+def tlds(index_dir):
+    return sorted(tld for tld in os.listdir(index_dir) if os.path.exists(os.path.join(index_dir, tld, META_NAME)))
+
+# Memory-mapped lifetimes of one TLD. Query methods return positions into
+# the first-seen order; names(positions) turns them into cnames.
+class LifetimeIndex:
+    def __init__(self, index_dir, tld):
+        self.path = os.path.join(index_dir, tld)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r'))
+        self.blob = np.memmap(os.path.join(self.path, 'names.bin'), dtype=np.uint8, mode='r') \
+            if self.offsets[-1] else np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.first)
+
+    def names(self, positions):
+        return [self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8') for i in positions]
+
+    # First seen in [start, end)
+    def first_seen_in(self, start, end):
+        lo = np.searchsorted(self.first, to_epoch(start), side='left')
+        hi = np.searchsorted(self.first, to_epoch(end), side='left')
+        return np.arange(lo, hi)
+
+    # Alive at time t: firstseen <= t <= lastseen
+    def active_at(self, t):
+        return self.overlapping(t, t)
+
+    # Lifetime intersects [start, end]: firstseen <= end and lastseen >= start
+    def overlapping(self, start, end):
+        hi = np.searchsorted(self.first, to_epoch(end), side='right')
+        return np.flatnonzero(np.asarray(self.last[:hi]) >= to_epoch(start))
+
+    # Number of lifetimes intersecting [start, end], from two binary searches:
+    # every name first seen by end, minus those already gone before start
+    def count_overlapping(self, start, end):
+        return int(np.searchsorted(self.first, to_epoch(end), side='right')
+                   - np.searchsorted(self.last_sorted, to_epoch(start), side='left'))
+
+    # (month, first seen that month, active during that month) rows
+    def monthly_counts(self, start=None, end=None):
+        if not len(self):
+            return []
+        start = pd.Timestamp(to_epoch(start) if start is not None else int(self.first[0]), unit='s')
+        end = pd.Timestamp(to_epoch(end) if end is not None else int(self.last_sorted[-1]), unit='s')
+        months = pd.date_range(start.to_period('M').to_timestamp(), end, freq='MS')
+        bounds = np.array([to_epoch(month) for month in months] + [to_epoch(months[-1] + pd.offsets.MonthBegin())])
+        first_seen = np.diff(np.searchsorted(self.first, bounds, side='left'))
+        active = (np.searchsorted(self.first, bounds[1:], side='left')
+                  - np.searchsorted(self.last_sorted, bounds[:-1], side='left'))
+        return [(month.strftime('%Y-%m'), int(new), int(alive)) for month, new, alive in zip(months, first_seen, active)]
+
+# Write month,first_seen,active per TLD, e.g. for trend plots
+def write_monthly_counts(index_dir, output_dir, start=None, end=None):
+    os.makedirs(output_dir, exist_ok=True)
+    columns = [('month', stageio.STRING), ('first-seen', stageio.INT), ('active', stageio.INT)]
+    for tld in tlds(index_dir):
+        with stageio.open_writer(os.path.join(output_dir, f"{tld}.csv"), columns) as writer:
+            writer.writerows(LifetimeIndex(index_dir, tld).monthly_counts(start, end))
+
+if __name__ == "__main__":
+    step3_output_dir = ""  # output_dir of step3.py
+    index_dir = "lifetime_index"
+    monthly_dir = "monthly_counts"
+    build_index(step3_output_dir, index_dir)
+    write_monthly_counts(index_dir, monthly_dir)
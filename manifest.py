@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+
+# Incremental runs: each stage keeps a manifest in its output directory that
+# records, per output, the fingerprints (size, mtime) of the inputs and the
+# parameters it was built from. Outputs whose inputs and parameters are
+# unchanged are skipped on the next run.
+MANIFEST_NAME = '.manifest.json'
+
+# Hash object behind file_hash, for hashing a file while it is read
+def content_digest():
+    return hashlib.blake2b(digest_size=16)
+
+def file_hash(path, block_size=1024 * 1024):
+    digest = content_digest()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Inputs run to hundreds of GB, so a fingerprint is only size and mtime:
+# hashing every completed input would read it a second time
+def fingerprint(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+# Compare a file against a recorded fingerprint; a file whose size or mtime
+# moved counts as changed
+def unchanged(path, recorded):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return stat.st_size == recorded.get('size') and stat.st_mtime_ns == recorded.get('mtime_ns')
+
+# Stable digest of stage parameters (sets are sorted first)
+def params_digest(params):
+    def normalize(value):
+        if isinstance(value, (set, frozenset)):
+            return sorted(normalize(item) for item in value)
+        if isinstance(value, dict):
+            return {str(key): normalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(item) for item in value]
+        return value
+    text = json.dumps(normalize(params), sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+# Write a file through a temp file in the same directory and rename it into place
+def atomic_write_text(path, text, encoding='utf-8'):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, 'w', encoding=encoding) as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class Manifest:
+    def __init__(self, output_dir, name=MANIFEST_NAME):
+        self.path = os.path.join(output_dir, name)
+        self.data = {'outputs': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.data = json.load(file)
+
+    def _key(self, output_path):
+        return os.path.basename(output_path)
+
+    def has(self, output_path):
+        return self._key(output_path) in self.data['outputs']
+
+    # True if output_path exists and was built from exactly these unchanged inputs and params.
+    # Outputs recorded with produced=False (the stage legitimately wrote nothing) need not exist.
+    def is_current(self, output_path, input_paths, params=None):
+        entry = self.data['outputs'].get(self._key(output_path))
+        if entry is None:
+            return False
+        if entry.get('produced', True) and not os.path.exists(output_path):
+            return False
+        if entry.get('params') != (None if params is None else params_digest(params)):
+            return False
+        inputs = {os.path.abspath(path) for path in input_paths}
+        if set(entry['inputs']) != inputs:
+            return False
+        return all(unchanged(path, recorded) for path, recorded in entry['inputs'].items())
+
+    def record(self, output_path, input_paths, params=None, produced=True):
+        self.data['outputs'][self._key(output_path)] = {
+            'inputs': {os.path.abspath(path): fingerprint(path) for path in input_paths},
+            'params': None if params is None else params_digest(params),
+            'produced': produced,
+        }
+
+    def forget(self, output_path):
+        self.data['outputs'].pop(self._key(output_path), None)
+
+    def save(self):
+        atomic_write_text(self.path, json.dumps(self.data, indent=1, sort_keys=True))
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import socket
+import resource
+
+# Structured run metrics: every stage appends JSON-lines events to one file
+# (metrics.jsonl in the working directory, or $CT_METRICS) -- one record per
+# chunk, per file (file_start, then file_done or file_failed) and per stage
+# run (stage_done). Records carry rows in/out, bytes read/written, elapsed
+# seconds split into I/O wait and compute, rows/s and peak RSS, so a slow TLD
+# shard or stage, and whether it is I/O-bound, shows up in
+#
+#   python metrics.py [metrics.jsonl]
+METRICS_FILE = 'metrics.jsonl'
+
+def metrics_path():
+    return os.environ.get('CT_METRICS', METRICS_FILE)
+
+# Peak resident set size of this process in bytes (ru_maxrss is KiB on Linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def rate(count, elapsed):
+    return count / elapsed if elapsed > 0 else None
+
+class Recorder:
+    def __init__(self, stage, path=None):
+        self.stage = stage
+        self.path = path
+
+    # Each event is written with a single append, so the workers of a
+    # process pool can share the file
+    def emit(self, event, **fields):
+        record = {'time': time.time(), 'host': socket.gethostname(), 'pid': os.getpid(),
+                  'stage': self.stage, 'event': event}
+        record.update(fields)
+        with open(self.path or metrics_path(), 'a') as file:
+            file.write(json.dumps(record, default=str) + '\n')
+
+    def file(self, input_path, **fields):
+        return FileRun(self, input_path, fields)
+
+# Metrics of one input file, used as a context manager around its processing.
+# An exception is recorded as file_failed and passed on. Stages add the time
+# they sat blocked on reading or writing to io_wait; the rest of elapsed is
+# reported as compute.
+class FileRun:
+    def __init__(self, recorder, input_path, fields):
+        self.recorder = recorder
+        self.input_path = input_path
+        self.fields = fields
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = os.path.getsize(input_path) if os.path.exists(input_path) else 0
+        self.bytes_written = 0
+        self.chunks = 0
+        self.io_wait = 0.0
+
+    def __enter__(self):
+        self.start = self.last_chunk = time.perf_counter()
+        self.recorder.emit('file_start', input=self.input_path, bytes_read=self.bytes_read, **self.fields)
+        return self
+
+    def chunk(self, rows_in, rows_out=0):
+        now = time.perf_counter()
+        elapsed = now - self.last_chunk
+        self.last_chunk = now
+        self.chunks += 1
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+        self.recorder.emit('chunk', input=self.input_path, chunk=self.chunks, rows_in=rows_in, rows_out=rows_out,
+                           elapsed=elapsed, rows_per_s=rate(rows_in, elapsed), **self.fields)
+
+    # Count an output file towards bytes_written
+    def wrote(self, output_path):
+        self.bytes_written += os.path.getsize(output_path)
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.perf_counter() - self.start
+        fields = dict(input=self.input_path, rows_in=self.rows_in, rows_out=self.rows_out,
+                      bytes_read=self.bytes_read, bytes_written=self.bytes_written, elapsed=elapsed,
+                      io_wait=self.io_wait, compute=elapsed - self.io_wait,
+                      rows_per_s=rate(self.rows_in, elapsed), peak_rss=peak_rss(), **self.fields)
+        if exc is None:
+            self.recorder.emit('file_done', **fields)
+        else:
+            self.recorder.emit('file_failed', error=f"{exc_type.__name__}: {exc}", **fields)
+        return False
+
+# Live progress of a stage over a known set of inputs, drawn on stderr at most
+# once per interval, with an ETA from the bytes done so far. close() records
+# the stage totals as a stage_done event.
+class Progress:
+    def __init__(self, recorder, total_files, total_bytes, stream=sys.stderr, interval=1.0):
+        self.recorder = recorder
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.interval = interval
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.drawn = 0
+
+    def advance(self, nbytes, failed=False):
+        self.files += 1
+        self.failed += bool(failed)
+        self.bytes += nbytes
+        self.draw()
+
+    def draw(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.drawn < self.interval:
+            return
+        self.drawn = now
+        elapsed = now - self.start
+        line = f"{self.recorder.stage}: {self.files}/{self.total_files} files"
+        if self.total_bytes:
+            line += f", {100 * self.bytes / self.total_bytes:.1f}% of {self.total_bytes / 2 ** 20:.1f} MiB"
+        if self.bytes and elapsed > 0:
+            eta = elapsed * (self.total_bytes - self.bytes) / self.bytes
+            line += f", {self.bytes / elapsed / 2 ** 20:.1f} MiB/s, ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}"
+        if self.failed:
+            line += f", {self.failed} failed"
+        end = '\r' if self.stream.isatty() else '\n'
+        self.stream.write(line + end)
+        self.stream.flush()
+
+    def close(self):
+        if self.total_files:
+            self.draw(force=True)
+            if self.stream.isatty():
+                self.stream.write('\n')
+        elapsed = time.perf_counter() - self.start
+        self.recorder.emit('stage_done', files=self.files, failed=self.failed, bytes_read=self.bytes,
+                           elapsed=elapsed, bytes_per_s=rate(self.bytes, elapsed), peak_rss=peak_rss())
+
+def read_events(path=None):
+    path = path or metrics_path()
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # torn last line of a killed run
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Inputs another run of stage is processing right now: started, not yet done
+# or failed, by a process that is still alive. Starts of crashed runs are
+# ignored. Processes on other hosts cannot be checked and count as alive.
+def active_files(stage, path=None):
+    started = {}
+    for event in read_events(path):
+        if event.get('stage') != stage or 'input' not in event:
+            continue
+        key = (event['host'], event['pid'], event['input'])
+        if event['event'] == 'file_start':
+            started[key] = event
+        elif event['event'] in ('file_done', 'file_failed'):
+            started.pop(key, None)
+    host = socket.gethostname()
+    return {input_path for (event_host, pid, input_path) in started
+            if pid != os.getpid() and (event_host != host or _alive(pid))}
+
+# Per-stage totals and per-file records of finished files
+def summarize(path=None):
+    stages = {}
+    files = []
+    for event in read_events(path):
+        if event['event'] not in ('file_done', 'file_failed'):
+            continue
+        totals = stages.setdefault(event['stage'], {'files': 0, 'failed': 0, 'rows_in': 0, 'rows_out': 0,
+                                                    'bytes_read': 0, 'bytes_written': 0, 'elapsed': 0.0,
+                                                    'io_wait': 0.0, 'peak_rss': 0})
+        totals['files'] += 1
+        totals['failed'] += event['event'] == 'file_failed'
+        for key in ('rows_in', 'rows_out', 'bytes_read', 'bytes_written', 'elapsed', 'io_wait'):
+            totals[key] += event.get(key) or 0
+        totals['peak_rss'] = max(totals['peak_rss'], event.get('peak_rss') or 0)
+        files.append(event)
+    return stages, files
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else metrics_path()
+    stages, files = summarize(path)
+    print(f"{'stage':<14}{'files':>7}{'failed':>7}{'rows in':>13}{'rows out':>13}{'seconds':>10}{'I/O wait':>10}"
+          f"{'rows/s':>12}{'MiB read':>10}{'MiB written':>13}{'peak RSS MiB':>14}")
+    for stage, totals in stages.items():
+        rows_per_s = rate(totals['rows_in'], totals['elapsed']) or 0
+        print(f"{stage:<14}{totals['files']:>7}{totals['failed']:>7}{totals['rows_in']:>13}{totals['rows_out']:>13}"
+              f"{totals['elapsed']:>10.1f}{totals['io_wait']:>10.1f}{rows_per_s:>12.0f}{totals['bytes_read'] / 2 ** 20:>10.1f}"
+              f"{totals['bytes_written'] / 2 ** 20:>13.1f}{totals['peak_rss'] / 2 ** 20:>14.1f}")
+    print("\nSlowest files:")
+    for event in sorted(files, key=lambda event: event.get('elapsed') or 0, reverse=True)[:10]:
+        status = '' if event['event'] == 'file_done' else f"  FAILED {event.get('error')}"
+        print(f"{event['elapsed']:>10.1f}s  {event['stage']:<14}{event['input']}  "
+              f"({event['rows_in']} rows, {(event.get('rows_per_s') or 0):.0f} rows/s){status}")
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,145 @@
-import os
 import csv
+import io
+import os
 from datetime import datetime
+import stageio
+import suffixes
+from manifest import Manifest
+import metrics
+
+# Columns of the ones/ outputs: first label plus first/last seen epochs
+COLUMNS = [('name', stageio.LABEL), ('first-seen', stageio.INT), ('last-seen', stageio.INT)]
+# Rows per batch written by a serial run (and per chunk event in the metrics file)
+CHUNK_ROWS = 100000
+
+recorder = metrics.Recorder('one')
+
+# Yield the fields of each input row
+def read_parts(input_path):
+    if stageio.is_columnar(input_path):
+        with stageio.open_reader(input_path) as reader:
+            for row in reader:
+                yield [str(row[0]), row[1], row[2]]
+    else:
+        # Streamed line by line, so memory does not grow with the file
+        with stageio.open_text(input_path, 'r') as input_file:
+            for line in input_file:
+                yield line.strip().split(',')
+
+# ICANN suffix of the names in a tokenization bucket (dot_<suffix>.csv)
+def suffix_for_input(input_path):
+    stem = stageio.stem(input_path)
+    return stem[len('dot_'):] if stem.startswith('dot_') else None
+
+# Registrable label of a DNS name. With the suffix of its bucket, the name
+# is split against the Public Suffix List, so subdomains (including
+# * and www) and multi-label suffixes such as co.uk are handled. Without it,
+# the leftmost label is used, skipping a leading wildcard or www.
+def first_label(dns_name, suffix=None):
+    if suffix:
+        label = suffixes.split(f"{dns_name}.{suffix}")[1]
+        if label is not None:
+            return label
+    domain_parts = dns_name.split('.')
+    if domain_parts[0] == "*":
+        return domain_parts[1]
+    elif domain_parts[0] == 'www':
+        return domain_parts[1]
+    else:
+        return domain_parts[0]
 
-def process_file(input_path, output_path, error_log_path):
+def output_file_for(input_path, output_path, output_format='csv'):
+    output_filename = f"{stageio.stem(input_path).split('_')[1]}_names"
+    return stageio.output_path(output_path, output_filename, output_format)
+
+def label_row(parts, suffix):
+    return [first_label(parts[0], suffix), parts[1], parts[2]]
+
+# Render rows as CSV text, in the dialect stageio's CSV writer uses
+def render_rows(rows):
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue()
+
+# Output rows of one newline-aligned byte range of a CSV file (runs in a
+# worker). With render, the rows are returned as CSV text, which takes far
+# less memory than lists of strings while the range waits to be written.
+def label_range(input_path, start, end, suffix, render):
+    lines = io.TextIOWrapper(io.BytesIO(stageio.read_range(input_path, start, end)))
+    rows = [label_row(line.strip().split(','), suffix) for line in lines]
+    return (render_rows(rows) if render else rows), len(rows)
+
+# (batch, rows) pairs of output rows in input order; with render each batch
+# is CSV text, otherwise a list of rows. With workers > 1 an uncompressed CSV
+# is split into byte ranges of chunk_bytes that are labelled in parallel.
+def labelled_batches(input_path, suffix, workers=1, chunk_bytes=64 * 1024 * 1024, render=False):
+    if workers > 1 and stageio.is_splittable(input_path):
+        yield from stageio.map_ranges(label_range, input_path, workers, chunk_bytes, suffix, render)
+        return
+    batch = []
+    for parts in read_parts(input_path):
+        batch.append(label_row(parts, suffix))
+        if len(batch) == CHUNK_ROWS:
+            yield (render_rows(batch) if render else batch), len(batch)
+            batch = []
+    yield (render_rows(batch) if render else batch), len(batch)
+
+# The output is rewritten atomically, so re-running never duplicates rows
+def process_file(input_path, output_path, error_log_path, output_format='csv', workers=1,
+                 chunk_bytes=64 * 1024 * 1024):
     try:
-        with open(input_path, 'r') as input_file:
-            lines = input_file.readlines()
-
-        output_filename = f"{os.path.splitext(os.path.basename(input_path))[0].split('_')[1]}_names.csv"
-        output_file_path = os.path.join(output_path, output_filename)
-
-        with open(output_file_path, 'a', newline='') as output_file:
-            csv_writer = csv.writer(output_file)
-            for line in lines:
-                parts = line.strip().split(',')
-                domain_parts = parts[0].split('.')
-                if domain_parts[0] == "*":
-                    csv_writer.writerow([domain_parts[1], parts[1], parts[2]])
-                elif domain_parts[0] == 'www':
-                    csv_writer.writerow([domain_parts[1], parts[1], parts[2]])
-                else:
-                    csv_writer.writerow([domain_parts[0], parts[1], parts[2]])
+        output_file_path = output_file_for(input_path, output_path, output_format)
+        suffix = suffix_for_input(input_path)
+
+        with recorder.file(input_path) as run:
+            with stageio.open_writer(output_file_path, COLUMNS) as csv_writer:
+                render = not stageio.is_columnar(output_file_path)
+                for batch, rows in labelled_batches(input_path, suffix, workers, chunk_bytes, render):
+                    if render:
+                        csv_writer.write_text(batch)
+                    else:
+                        csv_writer.writerows(batch)
+                    run.chunk(rows, rows)
+            run.wrote(output_file_path)
+        return True
 
     except Exception as e:
         log_error(error_log_path, f"Error processing file {input_path}: {str(e)}")
+        return False
 
 def log_error(log_path, error_message):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     with open(log_path, 'a') as log_file:
         log_file.write(f"{timestamp} - {error_message}\n")
 
-def process_directory(input_directory, output_directory, error_log_path):
+# With incremental=True, inputs unchanged since the last run are skipped
+def process_directory(input_directory, output_directory, error_log_path, output_format='csv', incremental=True,
+                      workers=1):
     try:
         os.makedirs(output_directory, exist_ok=True)
+        manifest = Manifest(output_directory)
+        pending = []
         for filename in os.listdir(input_directory):
-            if filename.endswith(".csv"):
+            if stageio.is_stage_file(filename):
                 input_path = os.path.join(input_directory, filename)
-                process_file(input_path, output_directory, error_log_path)
+                try:
+                    output_file_path = output_file_for(input_path, output_directory, output_format)
+                except IndexError as e:
+                    # e.g. others.csv, which has no _<suffix> part to name its output after
+                    log_error(error_log_path, f"Error processing file {input_path}: {str(e)}")
+                    continue
+                if not (incremental and manifest.is_current(output_file_path, [input_path])):
+                    pending.append((input_path, output_file_path))
+
+        progress = metrics.Progress(recorder, len(pending), sum(os.path.getsize(path) for path, _ in pending))
+        for input_path, output_file_path in pending:
+            done = process_file(input_path, output_directory, error_log_path, output_format=output_format,
+                                workers=workers)
+            if done:
+                manifest.record(output_file_path, [input_path])
+                manifest.save()
+            progress.advance(os.path.getsize(input_path), failed=not done)
+        progress.close()
     except Exception as e:
         log_error(error_log_path, f"Error processing directory {input_directory}: {str(e)}")
 
@@ -44,5 +147,7 @@ if __name__ == "__main__":
     input_directory = "psl"
     output_directory = "ones"
     error_log_path = "error_log.txt"
+    output_format = "csv"  # or "arrow" for columnar intermediates
+    workers = os.cpu_count() or 1  # Processes per input file; large files are split into byte ranges
 
-    process_directory(input_directory, output_directory, error_log_path)
+    process_directory(input_directory, output_directory, error_log_path, output_format=output_format, workers=workers)
@@ -0,0 +1,120 @@
+import os
+from collections import defaultdict
+from contextlib import nullcontext
+import stageio
+import one
+import frequency
+import remwords
+import wordfilter
+import forbidden
+from manifest import Manifest
+
+# Stage outputs the fused pipeline can write, with the directories the
+# standalone scripts use for them
+STAGE_DIRS = {
+    'ones': 'ones',
+    'frequency': 'frequency',
+    'filtered': 'filtered_sorted',
+    'wordfiltered': 'wordfiltered',
+}
+
+# Output path of every stage for one psl/ input file
+def stage_outputs(input_path, output_dirs, output_format='csv'):
+    tld = stageio.stem(input_path).split('_')[1]
+    return {
+        'ones': stageio.output_path(output_dirs['ones'], f"{tld}_names", output_format),
+        'frequency': stageio.output_path(output_dirs['frequency'], f"{tld}_names_freq", output_format),
+        'filtered': stageio.output_path(output_dirs['filtered'], f"{tld}_names_freq", output_format),
+        'wordfiltered': stageio.output_path(output_dirs['wordfiltered'], f"{tld}_names_freq", output_format),
+    }
+
+# Parameters each stage output depends on, besides the input file
+def stage_params(stage, forbidden_words, target_words):
+    words = set(forbidden.as_matcher(forbidden_words).words)
+    if stage == 'filtered':
+        return {'forbidden_words': words}
+    if stage == 'wordfiltered':
+        return {'forbidden_words': words, 'target_words': set(target_words)}
+    return None
+
+# Run one -> frequency -> remwords -> wordfilter over a single psl/ file in one
+# pass. Only the stage outputs listed in outputs are written.
+def process_file(input_path, output_dirs, outputs, forbidden_words, target_words, output_format='csv'):
+    paths = stage_outputs(input_path, output_dirs, output_format)
+
+    # one + frequency: extract the first label and count it
+    name_frequency = {}
+    suffix = one.suffix_for_input(input_path)
+    ones_writer = stageio.open_writer(paths['ones'], one.COLUMNS) if 'ones' in outputs else nullcontext()
+    with ones_writer:
+        for parts in one.read_parts(input_path):
+            name = one.first_label(parts[0], suffix)
+            if 'ones' in outputs:
+                ones_writer.writerow([name, parts[1], parts[2]])
+            name_frequency[name] = name_frequency.get(name, 0) + 1
+
+    if 'frequency' in outputs:
+        with stageio.open_writer(paths['frequency'], frequency.COLUMNS) as writer:
+            for name, freq in name_frequency.items():
+                writer.writerow([name, freq])
+
+    # remwords: drop forbidden tokens and re-aggregate
+    filtered_data = defaultdict(int)
+    for name, freq in name_frequency.items():
+        for filtered_name in remwords.filter_tokens(name, forbidden_words):
+            filtered_data[filtered_name] += freq
+    sorted_data = remwords.sort_by_frequency(filtered_data)
+
+    if 'filtered' in outputs:
+        with stageio.open_writer(paths['filtered'], remwords.COLUMNS, encoding='latin-1') as writer:
+            for name, freq in sorted_data:
+                writer.writerow([name, freq])
+
+    # wordfilter: keep the target words, in the order wordfilter reads them
+    filtered_words = {word: freq for word, freq in sorted_data if word in target_words}
+    if 'wordfiltered' in outputs and os.path.exists(paths['wordfiltered']):
+        os.remove(paths['wordfiltered'])
+    if 'wordfiltered' in outputs and filtered_words:
+        with stageio.open_writer(paths['wordfiltered'], wordfilter.COLUMNS) as writer:
+            for word, freq in filtered_words.items():
+                writer.writerow([word, freq])
+
+    return filtered_words
+
+# With incremental=True, input files whose requested outputs are all current
+# in their stage manifests are skipped
+def run_pipeline(input_directory, output_dirs=None, outputs=('wordfiltered',), forbidden_words=remwords.FORBIDDEN_WORDS,
+                 target_words=wordfilter.TARGET_WORDS, output_format='csv', error_log_path='error_log.txt',
+                 incremental=True):
+    output_dirs = dict(STAGE_DIRS, **(output_dirs or {}))
+    forbidden_words = forbidden.as_matcher(forbidden_words)
+    manifests = {}
+    for stage in outputs:
+        os.makedirs(output_dirs[stage], exist_ok=True)
+        manifests[stage] = Manifest(output_dirs[stage])
+    params = {stage: stage_params(stage, forbidden_words, target_words) for stage in outputs}
+
+    for filename in os.listdir(input_directory):
+        if stageio.is_stage_file(filename):
+            input_path = os.path.join(input_directory, filename)
+            try:
+                paths = stage_outputs(input_path, output_dirs, output_format)
+                if incremental and all(manifests[stage].is_current(paths[stage], [input_path], params[stage])
+                                       for stage in outputs):
+                    continue
+                filtered_words = process_file(input_path, output_dirs, outputs, forbidden_words, target_words,
+                                              output_format=output_format)
+                for stage in outputs:
+                    produced = stage != 'wordfiltered' or bool(filtered_words)
+                    manifests[stage].record(paths[stage], [input_path], params[stage], produced=produced)
+                    manifests[stage].save()
+            except Exception as e:
+                one.log_error(error_log_path, f"Error processing file {input_path}: {str(e)}")
+
+def main():
+    input_directory = 'psl'
+    outputs = ('filtered', 'wordfiltered')  # Any of: ones, frequency, filtered, wordfiltered
+    run_pipeline(input_directory, outputs=outputs)
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,106 @@
 import os
-import csv
 import re
 from collections import defaultdict
+import stageio
+import forbidden
+from manifest import Manifest
+from heavyhitters import SpaceSaving
+import metrics
+
+# Columns of the filtered_sorted/ outputs
+COLUMNS = [('name', stageio.LABEL), ('freq', stageio.INT)]
+# Approximate (top_k) outputs add the maximum over-estimate of each count
+APPROX_COLUMNS = COLUMNS + [('error', stageio.INT)]
+
+recorder = metrics.Recorder('remwords')
+
+# Forbidden words are read from forbidden_words.txt
+FORBIDDEN_WORDS = forbidden.load_words()
+
+# Split a name into tokens and keep those longer than 2 characters that contain no forbidden word.
+# forbidden_words may be a word set or a compiled forbidden.SubstringMatcher.
+def filter_tokens(name, forbidden_words):
+    matcher = forbidden.as_matcher(forbidden_words)
+    names = re.findall(r'\S+', name.strip().lower())  # Extract non-space sequences
+    filtered_names = []
+    for name in names:
+        # Check if the length is greater than 2
+        if len(name) > 2:
+            # Check if the name contains any forbidden words
+            contains_forbidden = matcher.search(name)
+            if not contains_forbidden:
+                filtered_names.append(name)
+    return filtered_names
+
+# Sort name frequencies in descending order
+def sort_by_frequency(filtered_data):
+    return sorted(filtered_data.items(), key=lambda x: x[1], reverse=True)
 
 # Function to read CSV file, filter out forbidden words, sort based on frequency, and save the filtered data to a new CSV file
-def filter_and_save_csv(input_file_path, output_file_path, forbidden_words):
-    filtered_data = defaultdict(int)
-    with open(input_file_path, 'r', encoding='latin-1') as file:
-        reader = csv.reader(file)
+# With top_k, only a bounded SpaceSaving summary of the top_k names is kept.
+# Returns the number of input rows read.
+def filter_and_save_csv(input_file_path, output_file_path, forbidden_words, top_k=None):
+    filtered_data = defaultdict(int) if top_k is None else SpaceSaving(top_k)
+    matcher = forbidden.as_matcher(forbidden_words)
+    rows = 0
+    with stageio.open_reader(input_file_path, encoding='latin-1') as reader:
         for row in reader:
+            rows += 1
             if row:
                 if len(row) >= 2:  # Check if there are at least two columns
-                    name = row[0].strip().lower()
                     freq = int(row[1])
-                    names = re.findall(r'\S+', name)  # Extract non-space sequences
-                    filtered_names = []
-                    for name in names:
-                        # Check if the length is greater than 2
-                        if len(name) > 2:
-                            # Check if the name contains any forbidden words
-                            contains_forbidden = any(word in name for word in forbidden_words)
-                            if not contains_forbidden:
-                                filtered_names.append(name)
+                    filtered_names = filter_tokens(str(row[0]), matcher)
                     if filtered_names:
                         for filtered_name in filtered_names:
-                            filtered_data[filtered_name] += freq  # Increment frequency
+                            if top_k is None:
+                                filtered_data[filtered_name] += freq  # Increment frequency
+                            else:
+                                filtered_data.update(filtered_name, freq)
+
+    if top_k is not None:
+        with stageio.open_writer(output_file_path, APPROX_COLUMNS, encoding='latin-1') as writer:
+            writer.writerows(filtered_data.items())
+        return rows
 
     # Sort filtered data based on frequency (in descending order)
-    sorted_data = sorted(filtered_data.items(), key=lambda x: x[1], reverse=True)
+    sorted_data = sort_by_frequency(filtered_data)
 
-    # Write sorted data to output CSV file
-    with open(output_file_path, 'w', newline='', encoding='latin-1') as file:
-        writer = csv.writer(file)
+    # Write sorted data to output file
+    with stageio.open_writer(output_file_path, COLUMNS, encoding='latin-1') as writer:
         for name, freq in sorted_data:
             writer.writerow([name, freq])
+    return rows
+
+# Filter every file of input_dir; with incremental=True, files whose input and
+# forbidden-word list are unchanged since the last run are skipped
+def process_files(input_dir, output_dir, forbidden_words, output_format='csv', incremental=True, top_k=None):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(output_dir)
+    matcher = forbidden.as_matcher(forbidden_words)
+    params = {'forbidden_words': set(matcher.words)}
+    # Only part of the digest when set, so exact-mode manifests stay valid
+    if top_k is not None:
+        params['top_k'] = top_k
+    for filename in os.listdir(input_dir):
+        if stageio.is_stage_file(filename):
+            input_file_path = os.path.join(input_dir, filename)
+            output_file_path = stageio.output_path(output_dir, stageio.stem(filename), output_format)
+            if incremental and manifest.is_current(output_file_path, [input_file_path], params):
+                continue
+            with recorder.file(input_file_path, top_k=top_k) as run:
+                run.rows_in = filter_and_save_csv(input_file_path, output_file_path, matcher, top_k=top_k)
+                run.wrote(output_file_path)
+            manifest.record(output_file_path, [input_file_path], params)
+            manifest.save()
 
 # Main function
 def main():
     input_dir = 'frequency_names'  # Directory containing input CSV files
     output_dir = 'filtered_sorted'  # Directory to save filtered and sorted CSV files
-    forbidden_words = {
-        "blog", "mail", "webmail", "nic", "dev", "test", "prod", "staging", "jenkins", "help",
-        "admin", "cdn", "dashboard", "lab", "beta", "api", "nginx", "sql", "mysql", "db",
-        "smtp", "pop", "imap", "cpanel", "domain", "frontend", "demo", "node", "gitlab",
-        "web", "system", "site", "shop", "www", "app", "stage",
-        "aaa", "root", "int", "deploy", "grafana", "log", "temp", "job",
-        "lms", "myftp", "ftp", "download", "link", "inbox", "cms", "data", "epp",
-        "whois", "pdf", "login", "auth", "microsoft365", "m365", "office",
-        "git", "github", "gitlab", "jenkins", "terraform", "ldap", "ssl", "update",
-        "archive", "img", "image", "registration", "faq", "autodiscover", "plugin",
-        "outlook", "myaccount"
-    }
-    os.makedirs(output_dir, exist_ok=True)
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.csv'):
-            input_file_path = os.path.join(input_dir, filename)
-            output_file_path = os.path.join(output_dir, filename)
-            filter_and_save_csv(input_file_path, output_file_path, forbidden_words)
+    output_format = 'csv'  # or 'arrow' for columnar intermediates
+    forbidden_words = FORBIDDEN_WORDS
+    top_k = None  # e.g. 100000 for bounded-memory approximate counts with an error column
+    process_files(input_dir, output_dir, forbidden_words, output_format=output_format, top_k=top_k)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,99 @@
+import os
+import heapq
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from wordcloud import WordCloud
+import stageio
+import remwords
+import forbidden
+from manifest import Manifest
+
+# Word clouds are rendered from precomputed name,freq counts (frequency.py /
+# remwords.py outputs) with generate_from_frequencies, so names are never
+# joined into one string and re-counted. Only the top_n names are kept and
+# the image is written straight to PNG without a matplotlib figure.
+
+# Read name,freq rows into a dict, keeping the top_n names. Rows without a
+# frequency column count once. With forbidden_words, names are split and
+# filtered the way remwords does it.
+def read_frequencies(file_path, top_n=None, forbidden_words=None):
+    matcher = None if forbidden_words is None else forbidden.as_matcher(forbidden_words)
+    frequencies = {}
+    with stageio.open_reader(file_path, encoding='latin-1') as reader:
+        for row in reader:
+            if not row:
+                continue
+            freq = int(row[1]) if len(row) >= 2 else 1
+            if matcher is None:
+                names = [str(row[0])]
+            else:
+                names = remwords.filter_tokens(str(row[0]), matcher)
+            for name in names:
+                frequencies[name] = frequencies.get(name, 0) + freq
+    if top_n is not None and len(frequencies) > top_n:
+        frequencies = dict(heapq.nlargest(top_n, frequencies.items(), key=lambda item: item[1]))
+    return frequencies
+
+def render(frequencies, output_path, width=800, height=400):
+    wordcloud = WordCloud(width=width, height=height, background_color='white')
+    wordcloud.generate_from_frequencies(frequencies)
+    # Write through a temp file so an interrupted run leaves no truncated PNG
+    tmp_path = stageio.temp_path_for(output_path)
+    try:
+        wordcloud.to_image().save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Render one file; returns False when it has no names
+def render_file(input_file_path, output_file_path, top_n=None, forbidden_words=None, width=800, height=400):
+    frequencies = read_frequencies(input_file_path, top_n=top_n, forbidden_words=forbidden_words)
+    if not frequencies:
+        print(f"No DNS names extracted from {os.path.basename(input_file_path)}. Skipping...")
+        return False
+    render(frequencies, output_file_path, width=width, height=height)
+    print(f"Word cloud generated for {os.path.basename(input_file_path)}.")
+    return True
+
+# Render a cloud per input file across a process pool. With incremental=True,
+# clouds whose input and options are unchanged since the last run are skipped.
+def render_directory(input_dir, output_dir, top_n=1000, forbidden_words=None, width=800, height=400,
+                     workers=None, incremental=True):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(output_dir)
+    if forbidden_words is not None:
+        forbidden_words = set(forbidden.as_matcher(forbidden_words).words)
+    params = {'top_n': top_n, 'forbidden_words': forbidden_words, 'width': width, 'height': height}
+
+    jobs = []
+    for filename in os.listdir(input_dir):
+        if stageio.is_stage_file(filename):
+            input_file_path = os.path.join(input_dir, filename)
+            output_file_path = os.path.join(output_dir, f'{stageio.stem(filename)}.png')
+            if incremental and manifest.is_current(output_file_path, [input_file_path], params):
+                continue
+            jobs.append((input_file_path, output_file_path))
+
+    # Largest inputs first, so a big TLD does not finish last on its own
+    jobs.sort(key=lambda job: os.path.getsize(job[0]), reverse=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_file, input_file_path, output_file_path, top_n, forbidden_words,
+                                   width, height): (input_file_path, output_file_path)
+                   for input_file_path, output_file_path in jobs}
+        for future in as_completed(futures):
+            input_file_path, output_file_path = futures[future]
+            try:
+                produced = future.result()
+            except Exception as e:
+                print(f"Error generating word cloud for {input_file_path}: {e}")
+                continue
+            manifest.record(output_file_path, [input_file_path], params, produced=produced)
+            manifest.save()
+
+def main():
+    input_dir = 'frequency_names'  # Directory containing name,freq CSV files
+    output_dir = 'wordclouds'  # Directory to save Word Cloud images
+    render_directory(input_dir, output_dir)
+
+if __name__ == "__main__":
+    main()
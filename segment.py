@@ -0,0 +1,204 @@
+import os
+import re
+import math
+from collections import deque
+from functools import lru_cache
+import wordsegment
+import stageio
+import forbidden
+import wordfilter
+import metrics
+from manifest import Manifest, file_hash
+
+# Unigram counts bundled with wordsegment (word<TAB>count, from the Google
+# Web Trillion Word Corpus), the same way suffixes.py uses publicsuffix2's PSL
+LEXICON_FILE = os.path.join(os.path.dirname(os.path.abspath(wordsegment.__file__)), 'unigrams.txt')
+
+# Columns of the segmented/ outputs, same shape as frequency's, so remwords
+# and wordfilter can run on them
+COLUMNS = [('name', stageio.LABEL), ('freq', stageio.INT)]
+
+recorder = metrics.Recorder('segment')
+
+# Hyphens, dots and other separators split a label; letters and digits
+# form separate runs (shop24 -> shop, 24)
+RUN = re.compile(r'[a-z]+|[0-9]+')
+
+# word -> count from a "word count" line per word; blank lines and '#'
+# comments are ignored
+def load_lexicon(path=LEXICON_FILE):
+    counts = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) == 2:
+                counts[fields[0].lower()] = counts.get(fields[0].lower(), 0) + int(fields[1])
+    return counts
+
+# Split concatenated words (redpillcoaching -> redpill, coaching) by Viterbi
+# over a unigram model: a word costs -log of its share of the lexicon's total
+# count, and the segmentation with the lowest total cost wins. Letters no
+# word covers form unknown pieces costing log(N / 10) plus log(10) per letter
+# (an unseen word is 10x less likely per extra letter), so known words are
+# still split off next to them (mrpforum -> mrp, forum).
+#
+# keep_words (the target words) get the count of the most frequent word, so
+# they are kept whole (redpill rather than red + pill); extra_words (the
+# forbidden words) are added with the lowest count if missing. Pieces shorter
+# than min_piece letters are not used, keep_words excepted: web counts of
+# single letters are high enough to chop unknown names into them.
+class Segmenter:
+    def __init__(self, lexicon_path=LEXICON_FILE, keep_words=(), extra_words=(), cache_size=1 << 20, min_piece=2):
+        self.lexicon_path = lexicon_path
+        counts = load_lexicon(lexicon_path)
+        top, bottom = max(counts.values()), min(counts.values())
+        for word in extra_words:
+            counts.setdefault(word, bottom)
+        for word in keep_words:
+            counts[word] = top
+        total = sum(counts.values())
+        self.costs = {word: math.log(total / count) for word, count in counts.items()
+                      if word.isalpha() and (len(word) >= min_piece or word in keep_words)}
+        self.max_length = max(map(len, self.costs))
+        self.unknown_cost = math.log(total / 10)
+        self.letter_cost = math.log(10)
+        # Labels repeat across TLDs and snapshots, so whole labels are cached
+        self.segment = lru_cache(maxsize=cache_size)(self._segment)
+
+    def split_run(self, run):
+        n = len(run)
+        best = [0.0] + [math.inf] * n
+        back = [0] * (n + 1)
+        # Cheapest start of an unknown piece, as best[start] - start * letter_cost,
+        # so the unknown piece ending at each position is found in one pass
+        open_cost, open_start = math.inf, 0
+        for end in range(1, n + 1):
+            if best[end - 1] - (end - 1) * self.letter_cost < open_cost:
+                open_cost, open_start = best[end - 1] - (end - 1) * self.letter_cost, end - 1
+            best[end] = open_cost + self.unknown_cost + end * self.letter_cost
+            back[end] = open_start
+            for start in range(max(0, end - self.max_length), end):
+                cost = self.costs.get(run[start:end])
+                if cost is not None and best[start] + cost < best[end]:
+                    best[end] = best[start] + cost
+                    back[end] = start
+        words = []
+        end = n
+        while end > 0:
+            words.append(run[back[end]:end])
+            end = back[end]
+        return words[::-1]
+
+    # Constituent words of a label, in order
+    def _segment(self, label):
+        label = label.lower()
+        # Punycode (IDN) labels are not made of lexicon words
+        if label.startswith('xn--'):
+            return (label,)
+        words = []
+        for run in RUN.findall(label):
+            if run.isdigit():
+                words.append(run)
+            else:
+                words.extend(self.split_run(run))
+        return tuple(words)
+
+_segmenter = None
+
+# Segmenter of this process (built once per worker)
+def default_segmenter(lexicon_path=LEXICON_FILE):
+    global _segmenter
+    if _segmenter is None or _segmenter.lexicon_path != lexicon_path:
+        _segmenter = Segmenter(lexicon_path, keep_words=wordfilter.TARGET_WORDS, extra_words=forbidden.load_words())
+    return _segmenter
+
+# word -> summed freq over (name, freq) rows, in first-seen order; every word
+# of a name gets the name's frequency
+def segment_batch(rows, lexicon_path=LEXICON_FILE):
+    segmenter = default_segmenter(lexicon_path)
+    counts = {}
+    for name, freq in rows:
+        for word in segmenter.segment(name):
+            counts[word] = counts.get(word, 0) + freq
+    return counts
+
+def read_batches(input_file_path, batch_rows):
+    batch = []
+    with stageio.open_reader(input_file_path, encoding='latin-1') as reader:
+        for row in reader:
+            if row and len(row) >= 2:
+                batch.append((str(row[0]), int(row[1])))
+                if len(batch) >= batch_rows:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+# Segment one name,freq file. With an executor, batches of batch_rows are
+# segmented in worker processes (at most 2 per worker in flight) and merged
+# in file order, so the output does not depend on scheduling.
+def segment_file(input_file_path, output_file_path, executor=None, workers=1, batch_rows=100000,
+                 lexicon_path=LEXICON_FILE):
+    counts = {}
+    with recorder.file(input_file_path) as run:
+        def merge(batch_counts, rows):
+            for word, freq in batch_counts.items():
+                counts[word] = counts.get(word, 0) + freq
+            run.chunk(rows, len(batch_counts))
+
+        if executor is None:
+            for batch in read_batches(input_file_path, batch_rows):
+                merge(segment_batch(batch, lexicon_path), len(batch))
+        else:
+            pending = deque()
+            for batch in read_batches(input_file_path, batch_rows):
+                pending.append((executor.submit(segment_batch, batch, lexicon_path), len(batch)))
+                if len(pending) >= 2 * workers:
+                    future, rows = pending.popleft()
+                    merge(future.result(), rows)
+            while pending:
+                future, rows = pending.popleft()
+                merge(future.result(), rows)
+
+        with stageio.open_writer(output_file_path, COLUMNS, encoding='latin-1') as writer:
+            writer.writerows(counts.items())
+        run.rows_out = len(counts)
+        run.wrote(output_file_path)
+    return counts
+
+# Segment every file of input_dir (frequency/ outputs); with incremental=True,
+# files whose input and lexicon are unchanged since the last run are skipped
+def process_files(input_dir, output_dir, output_format='csv', incremental=True, workers=1,
+                  lexicon_path=LEXICON_FILE):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(output_dir)
+    params = {'lexicon': file_hash(lexicon_path), 'target_words': set(wordfilter.TARGET_WORDS),
+              'forbidden_words': forbidden.load_words()}
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for filename in os.listdir(input_dir):
+            if stageio.is_stage_file(filename):
+                input_file_path = os.path.join(input_dir, filename)
+                output_file_path = stageio.output_path(output_dir, stageio.stem(filename), output_format)
+                if incremental and manifest.is_current(output_file_path, [input_file_path], params):
+                    continue
+                segment_file(input_file_path, output_file_path, executor, workers, lexicon_path=lexicon_path)
+                manifest.record(output_file_path, [input_file_path], params)
+                manifest.save()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+# Runs between frequency.py and remwords.py: point remwords at output_dir
+def main():
+    input_dir = 'frequency_names'  # frequency.py output
+    output_dir = 'segmented'  # name,freq of the constituent words
+    output_format = 'csv'  # or 'arrow' for columnar intermediates
+    workers = os.cpu_count() or 1
+    process_files(input_dir, output_dir, output_format=output_format, workers=workers)
+
+if __name__ == "__main__":
+    main()
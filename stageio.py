@@ -0,0 +1,528 @@
+import io
+import os
+import csv
+import time
+import queue
+import threading
+from collections import deque
+
+# Intermediate files between stages can be plain CSV (the export format) or
+# columnar Arrow IPC files. Columnar files store timestamps and counts as int64
+# and labels dictionary-encoded, and are memory-mapped on read.
+CSV_SUFFIX = '.csv'
+COLUMNAR_SUFFIX = '.arrow'
+# CSV files may also be compressed (dump.csv.gz); they are decompressed while
+# being read, so compressed CT extracts never need to be unpacked to disk
+COMPRESSION_SUFFIXES = ('.gz', '.zst', '.xz')
+CSV_SUFFIXES = (CSV_SUFFIX,) + tuple(CSV_SUFFIX + suffix for suffix in COMPRESSION_SUFFIXES)
+INPUT_SUFFIXES = CSV_SUFFIXES + (COLUMNAR_SUFFIX,)
+
+# Column kinds used in stage schemas
+LABEL = 'label'  # dictionary-encoded string
+STRING = 'string'
+INT = 'int'      # int64, also used for epoch timestamps
+
+def is_stage_file(filename):
+    return filename.endswith(INPUT_SUFFIXES)
+
+def is_columnar(path):
+    return path.endswith(COLUMNAR_SUFFIX)
+
+def is_csv(filename):
+    return filename.endswith(CSV_SUFFIXES)
+
+# Stage suffix of a file name (.csv, .csv.gz, .arrow, ...), or '' if it has none
+def stage_suffix(filename):
+    for suffix in INPUT_SUFFIXES:
+        if filename.endswith(suffix):
+            return suffix
+    return ''
+
+# File name without directory and stage suffix: in/dot_com.csv.gz -> dot_com
+def stem(path):
+    filename = os.path.basename(path)
+    return filename[:len(filename) - len(stage_suffix(filename))]
+
+# Output formats are 'csv', 'arrow', or compressed CSV: 'csv.gz', 'csv.zst', 'csv.xz'
+def suffix_for(output_format):
+    suffix = '.' + output_format
+    if suffix in INPUT_SUFFIXES:
+        return suffix
+    raise ValueError(f"Unknown output format: {output_format}")
+
+def compression_of(path):
+    for suffix in COMPRESSION_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return None
+
+def _open_compressed(path, mode, compression):
+    if compression == '.gz':
+        import gzip
+        # Level 6 is zlib's own default; gzip.open's 9 is much slower for little gain
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == '.xz':
+        import lzma
+        return lzma.open(path, mode)
+    if compression == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading or writing .zst files requires the zstandard package") from None
+        file = open(path, mode) if isinstance(path, (str, os.PathLike)) else path
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True, closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(file, closefd=True)
+    raise ValueError(f"Unknown compression: {compression}")
+
+# Raw stream over a binary file that feeds every byte read to digest (a
+# hashlib object), so a file can be hashed in the same pass that parses it
+class HashingStream(io.RawIOBase):
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.file.readinto(buffer)
+        self.digest.update(memoryview(buffer)[:n])
+        return n
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+# Raw stream that decompresses ahead of the reader on a background thread.
+# zlib, lzma and zstandard release the GIL while decompressing, so parsing
+# the previous block overlaps with decompressing the next ones.
+class PrefetchStream(io.RawIOBase):
+    def __init__(self, source, block_size=1 << 20, depth=4):
+        self.source = source
+        self.block_size = block_size
+        self.blocks = queue.Queue(depth)
+        self.block = memoryview(b'')
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while not self.stopped.is_set():
+                block = self.source.read(self.block_size)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.block:
+            if self.thread is None:
+                return 0
+            item = self.blocks.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self.thread = None
+                return 0
+            self.block = memoryview(item)
+        n = min(len(buffer), len(self.block))
+        buffer[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            if self.thread is not None:
+                self.thread.join()
+            self.source.close()
+        super().close()
+
+# Iterate an iterable (e.g. a pandas chunk reader) on a background thread
+# that stays up to depth items ahead, so reading and parsing the next chunk
+# overlaps with processing the current one. wait_seconds is the time the
+# consumer spent blocked waiting for input. depth=0 iterates in the caller's
+# thread (wait_seconds then covers all reading and parsing).
+class Prefetcher:
+    _END = object()
+
+    def __init__(self, iterable, depth=2):
+        self.iterator = iter(iterable)
+        self.wait_seconds = 0.0
+        self.thread = None
+        if depth > 0:
+            self.items = queue.Queue(depth)
+            self.stopped = threading.Event()
+            self.thread = threading.Thread(target=self._fill, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fill(self):
+        try:
+            for item in self.iterator:
+                if not self._put(item):
+                    return
+            self._put(self._END)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _next(self):
+        if self.thread is None:
+            return next(self.iterator, self._END)
+        item = self.items.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            item = self._next()
+            self.wait_seconds += time.perf_counter() - start
+            if item is self._END:
+                return
+            yield item
+
+    # Stop the reader thread; it finishes the chunk it is reading first
+    def close(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+# Run write jobs in submission order on a background thread, so formatting
+# the next batch overlaps with writing the previous one. At most depth jobs
+# are queued; wait_seconds is the time the producer was blocked on a full
+# queue. An error in a job is raised by the next submit or by close.
+# depth=0 runs jobs synchronously (wait_seconds then covers all writing).
+class BackgroundWriter:
+    def __init__(self, depth=4):
+        self.wait_seconds = 0.0
+        self.error = None
+        self.thread = None
+        if depth > 0:
+            self.jobs = queue.Queue(depth)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if self.error is None:
+                fn, args = job
+                try:
+                    fn(*args)
+                except Exception as e:
+                    self.error = e
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, fn, *args):
+        self._raise()
+        start = time.perf_counter()
+        if self.thread is None:
+            fn(*args)
+        else:
+            self.jobs.put((fn, args))
+        self.wait_seconds += time.perf_counter() - start
+
+    # Wait for every submitted job to finish
+    def close(self):
+        if self.thread is not None:
+            start = time.perf_counter()
+            self.jobs.put(None)
+            self.thread.join()
+            self.wait_seconds += time.perf_counter() - start
+            self.thread = None
+        self._raise()
+
+# File-like front for a text file whose writes go through a BackgroundWriter
+class AsyncTextFile(BackgroundWriter):
+    def __init__(self, file, depth=4):
+        super().__init__(depth)
+        self.file = file
+
+    def write(self, text):
+        self.submit(self.file.write, text)
+
+# open() for stage CSV files that also handles compressed files. compression
+# is inferred from path unless given (None for an uncompressed file).
+# Compressed files opened for appending get a new gzip member / xz stream /
+# zstd frame, which readers of the whole file handle transparently.
+# With digest (read mode only), the file's bytes (compressed, if it is) are
+# hashed as they are read.
+def open_text(path, mode='r', encoding=None, newline=None, compression='infer', digest=None):
+    if compression == 'infer':
+        compression = compression_of(path)
+    if digest is not None:
+        source = HashingStream(open(path, 'rb'), digest)
+        if compression is None:
+            return io.TextIOWrapper(io.BufferedReader(source), encoding=encoding, newline=newline)
+        path = io.BufferedReader(source)
+    if compression is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+    binary = _open_compressed(path, mode + 'b', compression)
+    if mode == 'r':
+        binary = io.BufferedReader(PrefetchStream(binary))
+    return io.TextIOWrapper(binary, encoding=encoding, newline=newline)
+
+# Memory-map a columnar file as a pyarrow Table; the buffers are not copied.
+# With digest, the mapped file is hashed first, which leaves its pages in
+# the page cache for the reads that follow.
+def read_table(path, digest=None):
+    import pyarrow as pa
+    with pa.memory_map(path, 'r') as source:
+        if digest is not None:
+            digest.update(memoryview(source.read_buffer()))
+            source.seek(0)
+        return pa.ipc.open_file(source).read_all()
+
+# A single uncompressed CSV can be split into byte ranges and processed in
+# parallel; compressed and columnar files are read whole
+def is_splittable(path):
+    return path.endswith(CSV_SUFFIX)
+
+# Split a file into (start, end) byte ranges of about chunk_bytes, each
+# ending just after a newline so no line is cut in two
+def byte_ranges(path, chunk_bytes=64 * 1024 * 1024):
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as file:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                file.seek(end)
+                file.readline()
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def read_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return file.read(end - start)
+
+# Run fn(path, start, end, *args) over the byte ranges of path on a process
+# pool and yield the results in file order, so merged outputs do not depend
+# on scheduling. At most 2 * workers ranges are in flight, which bounds the
+# memory held by results waiting to be merged.
+def map_ranges(fn, path, workers, chunk_bytes=64 * 1024 * 1024, *args):
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in byte_ranges(path, chunk_bytes):
+            pending.append(executor.submit(fn, path, start, end, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Iterate rows of a CSV or columnar file as lists
+class Reader:
+    def __init__(self, path, encoding=None, digest=None):
+        self.path = path
+        self.encoding = encoding
+        self.digest = digest
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __iter__(self):
+        if is_columnar(self.path):
+            for batch in read_table(self.path, self.digest).to_batches():
+                yield from map(list, zip(*(column.to_pylist() for column in batch.columns)))
+        else:
+            self.file = open_text(self.path, 'r', encoding=self.encoding, digest=self.digest)
+            yield from csv.reader(self.file)
+
+# With digest, the file is hashed in the same pass (see open_text)
+def open_reader(path, encoding=None, digest=None):
+    return Reader(path, encoding=encoding, digest=digest)
+
+# Temp path next to path, renamed over it once the output is complete
+def temp_path_for(path):
+    return f"{path}.tmp.{os.getpid()}"
+
+# csv.writer-like writer for columnar files. Rows are buffered into Arrow
+# arrays batch by batch and written as one table on close, with label
+# columns sharing a single dictionary.
+class ColumnarWriter:
+    def __init__(self, path, columns, batch_rows=65536):
+        self.path = path
+        self.columns = columns
+        self.batch_rows = batch_rows
+        self.pending = []
+        self.chunks = [[] for _ in columns]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        self.chunks = None
+
+    def writerow(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_rows:
+            self._flush_pending()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    # Append whole columns at once (e.g. pandas Series or numpy arrays)
+    def write_columns(self, values):
+        import pyarrow as pa
+        self._flush_pending()
+        for chunks, (name, kind), column in zip(self.chunks, self.columns, values):
+            chunks.append(pa.array(column, type=_arrow_type(kind), from_pandas=True))
+
+    def _flush_pending(self):
+        if self.pending:
+            rows, self.pending = self.pending, []
+            self.write_columns([_convert(kind, values) for (name, kind), values in zip(self.columns, zip(*rows))])
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        if self.chunks is None:
+            return
+        self._flush_pending()
+        arrays = []
+        for (name, kind), chunks in zip(self.columns, self.chunks):
+            column = pa.chunked_array(chunks, type=_arrow_type(kind))
+            if kind == LABEL:
+                column = pc.dictionary_encode(column)
+            arrays.append(column.combine_chunks())
+        table = pa.Table.from_arrays(arrays, names=[name for name, kind in self.columns])
+        tmp_path = temp_path_for(self.path)
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.chunks = None
+
+def _arrow_type(kind):
+    import pyarrow as pa
+    return pa.int64() if kind == INT else pa.string()
+
+def _convert(kind, values):
+    if kind == INT:
+        return [None if value in ('', None) else int(float(value)) for value in values]
+    return [None if value is None else str(value) for value in values]
+
+# csv.writer with the same interface as ColumnarWriter. In 'w' mode the
+# file is written to a temp file and renamed into place on a clean close,
+# so a crash never leaves a partial output behind.
+class CSVWriter:
+    def __init__(self, path, mode='w', encoding=None):
+        self.path = path
+        self.tmp_path = temp_path_for(path) if mode == 'w' else None
+        self.file = open_text(self.tmp_path or path, mode, newline='', encoding=encoding,
+                              compression=compression_of(path))
+        self.writer = csv.writer(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        self.file.close()
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+
+    def write_columns(self, values):
+        self.writer.writerows(zip(*values))
+
+    # Append rows already rendered as CSV text
+    def write_text(self, text):
+        self.file.write(text)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.tmp_path is not None:
+            os.replace(self.tmp_path, self.path)
+
+# Open a stage output; the format follows the file suffix. Columnar files
+# are always rewritten, mode only applies to CSV.
+def open_writer(path, columns, mode='w', encoding=None):
+    if is_columnar(path):
+        return ColumnarWriter(path, columns)
+    return CSVWriter(path, mode=mode, encoding=encoding)
+
+def output_path(output_dir, stem, output_format='csv'):
+    return os.path.join(output_dir, stem + suffix_for(output_format))
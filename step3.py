@@ -1,42 +1,156 @@
 import os
+import numpy as np
 import pandas as pd
 import logging
-import gc
 import fcntl
+import heapq
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from manifest import Manifest
+import stageio
+import metrics
 
 # Set up logging
 logging.basicConfig(filename='process.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
+recorder = metrics.Recorder('step3')
 
-def process_group(group):
-    min_time = group['leafTime'].dropna().min()
-    max_time = group['leafTime'].dropna().max()
-    return pd.Series({'firstseen': min_time, 'lastseen': max_time})
+# Running (firstseen, lastseen) per cname, kept as epoch seconds.
+# Each cname maps to a slot in two float arrays, so memory grows with the
+# number of distinct cnames rather than with the number of rows.
+class LifetimeStore:
+    def __init__(self):
+        self.slots = {}
+        self.firstseen = np.empty(0)
+        self.lastseen = np.empty(0)
 
-def process_file(file_path, tld_output_dir, checkpoint_file, lock_file, chunk_size=100000):
+    def __len__(self):
+        return len(self.slots)
+
+    # Widen the stored ranges with per-chunk minima and maxima
+    def update(self, cnames, mins, maxs):
+        slots = self.slots
+        codes = np.fromiter((slots.setdefault(cname, len(slots)) for cname in cnames),
+                            dtype=np.int64, count=len(cnames))
+        if len(slots) > len(self.firstseen):
+            grow = max(len(slots), 2 * len(self.firstseen)) - len(self.firstseen)
+            self.firstseen = np.concatenate([self.firstseen, np.full(grow, np.nan)])
+            self.lastseen = np.concatenate([self.lastseen, np.full(grow, np.nan)])
+        self.firstseen[codes] = np.fmin(self.firstseen[codes], mins)
+        self.lastseen[codes] = np.fmax(self.lastseen[codes], maxs)
+
+    # Yield (cname, firstseen, lastseen) sorted by cname, times as epoch seconds
+    def sorted_entries(self):
+        for cname in sorted(self.slots):
+            slot = self.slots[cname]
+            yield cname, self.firstseen[slot], self.lastseen[slot]
+
+    def clear(self):
+        self.slots = {}
+        self.firstseen = np.empty(0)
+        self.lastseen = np.empty(0)
+
+# Write a sorted run of (cname, firstseen, lastseen) entries to the spill directory
+def spill_run(store, spill_dir):
+    fd, run_path = tempfile.mkstemp(suffix='.run', dir=spill_dir)
+    with os.fdopen(fd, 'w') as run:
+        for cname, firstseen, lastseen in store.sorted_entries():
+            run.write(f"{cname}\t{float(firstseen)!r}\t{float(lastseen)!r}\n")
+    store.clear()
+    return run_path
+
+def read_run(run_path):
+    with open(run_path, 'r') as run:
+        for line in run:
+            cname, firstseen, lastseen = line.rstrip('\n').split('\t')
+            yield cname, float(firstseen), float(lastseen)
+
+# k-way merge of sorted runs, combining the ranges of equal cnames
+def merge_runs(runs):
+    current = None
+    for cname, firstseen, lastseen in heapq.merge(*runs, key=lambda entry: entry[0]):
+        if current is not None and current[0] == cname:
+            current = (cname, np.fmin(current[1], firstseen), np.fmax(current[2], lastseen))
+        else:
+            if current is not None:
+                yield current
+            current = (cname, firstseen, lastseen)
+    if current is not None:
+        yield current
+
+# Write entries as cname;firstseen;lastseen, converting epoch seconds in batches.
+# Returns the number of rows written.
+def write_lifetimes(f, entries, batch_size=100000):
+    batch = []
+    rows = 0
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            write_lifetime_batch(f, batch)
+            rows += len(batch)
+            batch = []
+    write_lifetime_batch(f, batch)
+    return rows + len(batch)
+
+def write_lifetime_batch(f, batch):
+    if not batch:
+        return
+    cnames, firstseen, lastseen = zip(*batch)
+    firstseen = pd.to_datetime(np.array(firstseen, dtype=float), unit='s', errors='coerce')
+    lastseen = pd.to_datetime(np.array(lastseen, dtype=float), unit='s', errors='coerce')
+    f.write(''.join(f"{cname};{first};{last}\n" for cname, first, last in zip(cnames, firstseen, lastseen)))
+
+# Per-cname min/max leafTime of one chunk, as epoch seconds
+def reduce_chunk(chunk):
+    leaf_time = pd.to_numeric(chunk['leafTime'], errors='coerce')
+    return leaf_time.groupby(chunk['cname'], sort=False).agg(['min', 'max'])
+
+# max_entries_in_memory bounds the number of distinct cnames held at once; when it
+# is reached the store is spilled as a sorted run and the runs are merged at the end.
+# Up to queue_depth chunks are read ahead on a background thread and output
+# batches are written behind one, so I/O overlaps with aggregation (0 disables).
+def process_file(file_path, tld_output_dir, checkpoint_file, lock_file, chunk_size=100000,
+                 max_entries_in_memory=None, spill_dir=None, queue_depth=2):
+    run_dir = None
+    tmp_file = None
     try:
-        print(f"Current: {file_path}")
-        logging.info(f"Starting to process file: {file_path}")   
-        cname_entries = {}
-        for chunk in pd.read_csv(file_path, header=None, names=['cname', 'leafTime'], chunksize=chunk_size):
-            chunk['leafTime'] = pd.to_datetime(chunk['leafTime'], unit='s', errors='coerce')
-            chunk['cname'] = chunk['cname'].astype('category')
-            grouped = chunk.groupby('cname').apply(process_group).reset_index()
-            grouped.columns = ['cname', 'firstseen', 'lastseen']
-            merged_chunk = pd.merge(chunk, grouped, on='cname')
-            merged_chunk.sort_values(by=['cname', 'leafTime'], inplace=True)
-            for index, row in merged_chunk.iterrows():
-                cname = row['cname']
-                if cname not in cname_entries:
-                    cname_entries[cname] = (row['firstseen'], row['lastseen'])
-            del chunk, grouped, merged_chunk
-            gc.collect()
-
-        output_file = os.path.join(tld_output_dir, os.path.basename(file_path))
-        with open(output_file, 'w') as f:
-            for cname, (firstseen, lastseen) in cname_entries.items():
-                f.write(f"{cname};{firstseen};{lastseen}\n")
-              
+        logging.info(f"Starting to process file: {file_path}")
+        with recorder.file(file_path, tld=os.path.basename(tld_output_dir)) as run:
+            store = LifetimeStore()
+            runs = []
+            with stageio.open_text(file_path) as source, stageio.Prefetcher(
+                    pd.read_csv(source, header=None, names=['cname', 'leafTime'], dtype={'cname': str},
+                                chunksize=chunk_size), depth=queue_depth) as chunks:
+                for chunk in chunks:
+                    grouped = reduce_chunk(chunk)
+                    store.update(grouped.index, grouped['min'].to_numpy(dtype=float), grouped['max'].to_numpy(dtype=float))
+                    run.chunk(len(chunk), len(grouped))
+                    if max_entries_in_memory is not None and len(store) >= max_entries_in_memory:
+                        if run_dir is None:
+                            run_dir = tempfile.mkdtemp(prefix='step3-', dir=spill_dir or tld_output_dir)
+                        runs.append(spill_run(store, run_dir))
+                run.io_wait += chunks.wait_seconds
+
+            if runs:
+                logging.info(f"Merging {len(runs)} spilled runs for {file_path}")
+                entries = merge_runs([read_run(run_path) for run_path in runs] + [store.sorted_entries()])
+            else:
+                entries = store.sorted_entries()
+
+            # Write to a temp file and rename, so a crash never leaves a partial output.
+            # The output keeps the input's name, so compressed inputs give compressed outputs.
+            output_file = os.path.join(tld_output_dir, os.path.basename(file_path))
+            tmp_file = f"{output_file}.tmp.{os.getpid()}"
+            with stageio.open_text(tmp_file, 'w', compression=stageio.compression_of(output_file)) as f:
+                with stageio.AsyncTextFile(f, depth=queue_depth) as writer:
+                    # rows_out of the file is the number of distinct cnames, not the per-chunk sum
+                    run.rows_out = write_lifetimes(writer, entries)
+                run.io_wait += writer.wait_seconds
+            os.replace(tmp_file, output_file)
+            run.wrote(output_file)
+
+        # The checkpoint is only updated once the output is in place
         # Create or acquire the lock
         with open(lock_file, 'w') as lockf:
             fcntl.flock(lockf, fcntl.LOCK_EX)
@@ -46,43 +160,106 @@ def process_file(file_path, tld_output_dir, checkpoint_file, lock_file, chunk_si
             fcntl.flock(lockf, fcntl.LOCK_UN)
           
         logging.info(f"Processed file {file_path} successfully.")
+        return True
         
     except Exception as e:
         logging.error(f"Error processing file {file_path}: {e}", exc_info=True)
+        return False
+
+    finally:
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
 
-def compare_timestamps_and_write_sorted(input_dir, output_dir, checkpoint_file, lock_file, max_entries_per_file=100000):
+# Run process_file over (file_path, tld_output_dir) jobs on a process pool,
+# largest files first so a single huge shard is not left as the straggler.
+# on_success(file_path, tld_output_dir) is called in this process as each file completes.
+def process_files_parallel(jobs, checkpoint_file, lock_file, workers, max_entries_in_memory=None, spill_dir=None,
+                           on_success=None, chunk_size=100000, queue_depth=2):
+    jobs = sorted(jobs, key=lambda job: os.path.getsize(job[0]), reverse=True)
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file, file_path, tld_output_dir, checkpoint_file, lock_file, chunk_size=chunk_size,
+                                   max_entries_in_memory=max_entries_in_memory, spill_dir=spill_dir,
+                                   queue_depth=queue_depth): (file_path, tld_output_dir)
+                   for file_path, tld_output_dir in jobs}
+        for future in as_completed(futures):
+            file_path, tld_output_dir = futures[future]
+            if not future.result():
+                failed.append(file_path)
+            elif on_success is not None:
+                on_success(file_path, tld_output_dir)
+    return failed
+
+def compare_timestamps_and_write_sorted(input_dir, output_dir, checkpoint_file, lock_file, max_entries_per_file=100000, workers=1,
+                                        max_entries_in_memory=None, spill_dir=None, chunk_size=100000, queue_depth=2):
     os.makedirs(output_dir, exist_ok=True)
     processed_files = set()
     if os.path.exists(checkpoint_file):
         with open(checkpoint_file, 'r') as cf:
             processed_files = set(cf.read().splitlines())
     
-    #To avoid processing the currently active file
-    active_files = set()
-    if os.path.exists('process.log'):
-        with open('process.log', 'r') as logf:
-            lines = logf.readlines()
-            for line in lines:
-                if 'Starting to process file:' in line:
-                    parts = line.split('Starting to process file:')
-                    if len(parts) > 1:
-                        active_files.add(parts[1].strip())
+    # To avoid processing the files another run is working on right now, as
+    # recorded in the metrics file (crashed runs do not count as active)
+    active_files = metrics.active_files('step3')
+
+    # Per-TLD manifests record the fingerprint of the input each output was built
+    # from, so changed inputs are redone. Files only listed in the checkpoint come
+    # from runs before the manifest existed and are treated as done.
+    manifests = {}
 
+    def record_done(file_path, tld_output_dir):
+        manifests[tld_output_dir].record(os.path.join(tld_output_dir, os.path.basename(file_path)), [file_path])
+        manifests[tld_output_dir].save()
+        progress.advance(os.path.getsize(file_path))
+
+    jobs = []
     for tld_dir in os.listdir(input_dir):
         tld_path = os.path.join(input_dir, tld_dir)
         if os.path.isdir(tld_path):
             tld_output_dir = os.path.join(output_dir, tld_dir)
             os.makedirs(tld_output_dir, exist_ok=True)
+            manifests[tld_output_dir] = Manifest(tld_output_dir)
             
             for filename in os.listdir(tld_path):
-                if filename.endswith(".csv"):
+                if stageio.is_csv(filename):
                     file_path = os.path.join(tld_path, filename)
-                    if file_path not in processed_files and file_path not in active_files:
-                        process_file(file_path, tld_output_dir, checkpoint_file, lock_file)
+                    output_file = os.path.join(tld_output_dir, filename)
+                    if manifests[tld_output_dir].has(output_file):
+                        done = manifests[tld_output_dir].is_current(output_file, [file_path])
+                    else:
+                        done = file_path in processed_files
+                    if not done and file_path not in active_files:
+                        jobs.append((file_path, tld_output_dir))
+
+    progress = metrics.Progress(recorder, len(jobs), sum(os.path.getsize(file_path) for file_path, _ in jobs))
+    if workers == 1:
+        for file_path, tld_output_dir in jobs:
+            if process_file(file_path, tld_output_dir, checkpoint_file, lock_file, chunk_size=chunk_size,
+                            max_entries_in_memory=max_entries_in_memory, spill_dir=spill_dir, queue_depth=queue_depth):
+                record_done(file_path, tld_output_dir)
+            else:
+                progress.advance(os.path.getsize(file_path), failed=True)
+    else:
+        failed = process_files_parallel(jobs, checkpoint_file, lock_file, workers,
+                                        max_entries_in_memory=max_entries_in_memory, spill_dir=spill_dir,
+                                        on_success=record_done, chunk_size=chunk_size, queue_depth=queue_depth)
+        if failed:
+            logging.error(f"{len(failed)} file(s) failed and will be retried on the next run.")
+            for file_path in failed:
+                progress.advance(os.path.getsize(file_path), failed=True)
+    progress.close()
 
 if __name__ == "__main__":
     input_dir = ""
     output_dir = ""
     checkpoint_file = "checkpoint.txt"
     lock_file = "lockfile.lck"
-    compare_timestamps_and_write_sorted(input_dir, output_dir, checkpoint_file, lock_file)
+    workers = os.cpu_count() or 1  # Set to 1 for the old single-process behaviour
+    max_entries_in_memory = None  # Distinct cnames per worker before spilling sorted runs to disk
+    chunk_size = 100000  # Rows per chunk read from an input file
+    queue_depth = 2  # Chunks read ahead / batches written behind per worker; 0 for no background I/O
+    compare_timestamps_and_write_sorted(input_dir, output_dir, checkpoint_file, lock_file, workers=workers,
+                                        max_entries_in_memory=max_entries_in_memory, chunk_size=chunk_size,
+                                        queue_depth=queue_depth)
@@ -0,0 +1,154 @@
+from functools import lru_cache
+import publicsuffix2
+
+# Public Suffix List loaded once into a trie keyed on reversed labels
+# ("uk" -> "co" -> ...). Each node is a dict of child label -> node; the keys
+# RULE and EXCEPTION mark the end of a normal rule and of a "!" exception
+# rule, and a "*" child is a wildcard rule. RULE holds the section of the
+# list the rule comes from (ICANN or PRIVATE).
+RULE = 0
+EXCEPTION = 1
+
+ICANN = 'icann'
+PRIVATE = 'private'
+
+# Trie built from a PSL file. Rules are added both as written and in
+# punycode, since CT logs carry IDNs as xn-- labels.
+def load_trie(psl_file=publicsuffix2.PSL_FILE):
+    root = {}
+    depth = 1
+    section = ICANN
+    with open(psl_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            rule = line.strip().split(' ')[0].lower()
+            if '===begin private domains===' in line.lower():
+                section = PRIVATE
+            if not rule or rule.startswith('//'):
+                continue
+            exception = rule.startswith('!')
+            rule = rule.lstrip('!')
+            for form in {rule, _to_ascii(rule)}:
+                node = root
+                labels = form.split('.')
+                for label in reversed(labels):
+                    node = node.setdefault(label, {})
+                if exception:
+                    node[EXCEPTION] = True
+                else:
+                    node[RULE] = section
+                depth = max(depth, len(labels))
+    return root, depth
+
+def _to_ascii(rule):
+    try:
+        return '.'.join(label if label == '*' else label.encode('idna').decode('ascii') for label in rule.split('.'))
+    except UnicodeError:
+        return rule
+
+class SuffixSplitter:
+    def __init__(self, psl_file=publicsuffix2.PSL_FILE, cache_size=1 << 20):
+        self.root, self.max_depth = load_trie(psl_file)
+        # The suffix only depends on the last max_depth labels, which names
+        # under the same parent domain share, so that tail is what gets cached
+        self.suffix_length = lru_cache(maxsize=cache_size)(self._suffix_length)
+        self.bucket_length = lru_cache(maxsize=cache_size)(self._bucket_length)
+
+    # Number of trailing labels forming the public suffix, per the PSL
+    # algorithm: longest matching rule wins, exceptions drop their leftmost
+    # label, and an unlisted TLD is a suffix on its own (implicit "*" rule)
+    def _suffix_length(self, tail):
+        node = self.root
+        length = 1
+        for depth, label in enumerate(reversed(tail), 1):
+            child = node.get(label)
+            wildcard = node.get('*')
+            if child is not None and EXCEPTION in child:
+                return depth - 1
+            if child is not None and RULE in child:
+                length = depth
+            elif wildcard is not None and RULE in wildcard:
+                length = depth
+            if child is None:
+                if wildcard is None:
+                    break
+                child = wildcard
+            node = child
+        return length
+
+    # Number of trailing labels of the longest ICANN rule the name falls
+    # under, matching labels literally: private rules (herokuapp.com) and
+    # labels a wildcard rule would expand (*.kawasaki.jp) are not followed, so
+    # the result is always a suffix the list names itself
+    def _bucket_length(self, tail):
+        node = self.root
+        length = 1
+        for depth, label in enumerate(reversed(tail), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if node.get(RULE) == ICANN:
+                length = depth
+        return length
+
+    # Lowercased ICANN suffix a name is grouped under (com, co.uk, ...). A
+    # name under a private or wildcard suffix is grouped with its ICANN
+    # parent (x.herokuapp.com under com), which keeps the set of groups
+    # bounded by the list.
+    def bucket(self, name):
+        labels = name.rstrip('.').split('.')
+        tail = tuple(label.lower() for label in labels[-self.max_depth:])
+        n = min(self.bucket_length(tail), self.suffix_length(tail), len(labels))
+        return '.'.join(tail[-n:])
+
+    # (public suffix, registrable label, subdomain labels) for a DNS name.
+    # The registrable label is None when the name is itself a public suffix.
+    def split(self, name):
+        labels = name.rstrip('.').split('.')
+        tail = tuple(label.lower() for label in labels[-self.max_depth:])
+        n = min(self.suffix_length(tail), len(labels))
+        suffix = '.'.join(labels[-n:])
+        if len(labels) == n:
+            return suffix, None, []
+        return suffix, labels[-n - 1], labels[:-n - 1]
+
+    # Batch API: split every distinct name once. Returns a list, or for a
+    # pandas Series a DataFrame with suffix, label, subdomain, rest (the name
+    # without its public suffix, or the whole name if it is a suffix) and
+    # bucket (see bucket()).
+    def split_many(self, names):
+        if hasattr(names, 'unique'):
+            import numpy as np
+            import pandas as pd
+            names = names.astype(str)
+            unique_names = names.unique()
+            codes = pd.Index(unique_names).get_indexer(names)
+            parts = [self.split(name) for name in unique_names]
+            columns = {
+                'suffix': [suffix for suffix, label, subdomain in parts],
+                'label': [label for suffix, label, subdomain in parts],
+                'subdomain': ['.'.join(subdomain) for suffix, label, subdomain in parts],
+                'rest': [name if label is None else name.rstrip('.')[:-len(suffix) - 1]
+                         for name, (suffix, label, subdomain) in zip(unique_names, parts)],
+                'bucket': [self.bucket(name) for name in unique_names],
+            }
+            return pd.DataFrame({key: np.array(values, dtype=object)[codes] for key, values in columns.items()},
+                                index=names.index)
+        parts = {}
+        result = []
+        for name in names:
+            if name not in parts:
+                parts[name] = self.split(name)
+            result.append(parts[name])
+        return result
+
+_default_splitter = None
+
+# Splitter over the PSL bundled with publicsuffix2, loaded once per process
+def default_splitter():
+    global _default_splitter
+    if _default_splitter is None:
+        _default_splitter = SuffixSplitter()
+    return _default_splitter
+
+def split(name):
+    return default_splitter().split(name)
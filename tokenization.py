@@ -1,68 +1,317 @@
+import io
 import os
 import pandas as pd
-from publicsuffix2 import PublicSuffixList
-
-# Initialize Public Suffix List
-psl = PublicSuffixList()
-
-# Function to process a CSV file
-def process_csv(file_path, result_folder):
-    df = pd.read_csv(file_path, header=None)
-
-    # Create separate DataFrames for each TLD
-    tld_dataframes = {}
-    
-    processed_rows = 0
-    
-    for index, row in df.iterrows():
-        dns_name = str(row.iloc[0])  # Access the first (and only) column directly
-        first_seen = row.iloc[1]  # Access the second column for "first seen"
-        last_seen = row.iloc[2]   # Access the third column for "last seen"
-
-        # Extract TLD using manual method
-        dot_index = dns_name.rfind('.')
-        tld = dns_name[dot_index + 1:]
-
-        # Check if TLD is in Public Suffix List
-        if psl.get_public_suffix(tld) == tld:
-            tld_key = f"dot_{tld}"
+import stageio
+import manifest
+import suffixes
+import metrics
+
+recorder = metrics.Recorder('tokenization')
+
+# Buffered per-TLD writer that flushes once a byte or row budget is reached.
+# Flushes are appended on a background thread (up to queue_depth pending, 0
+# for synchronous writes); io_wait is the time spent blocked on them.
+class TLDWriter:
+    def __init__(self, result_folder, flush_bytes=8 * 1024 * 1024, flush_rows=500000, suffix=stageio.CSV_SUFFIX,
+                 queue_depth=4):
+        self.result_folder = result_folder
+        self.suffix = suffix
+        self.flush_bytes = flush_bytes
+        self.flush_rows = flush_rows
+        self.queue_depth = queue_depth
+        self.buffers = {}
+        self.buffered_bytes = {}
+        self.buffered_rows = {}
+        self.io = None
+        self.io_wait = 0.0
+
+    def write_frame(self, tld_key, frame):
+        self.write(tld_key, frame.to_csv(header=False, index=False), len(frame))
+
+    def write(self, tld_key, text, rows):
+        self.buffers.setdefault(tld_key, []).append(text)
+        self.buffered_bytes[tld_key] = self.buffered_bytes.get(tld_key, 0) + len(text)
+        self.buffered_rows[tld_key] = self.buffered_rows.get(tld_key, 0) + rows
+        if self.buffered_bytes[tld_key] >= self.flush_bytes or self.buffered_rows[tld_key] >= self.flush_rows:
+            self.flush(tld_key)
+
+    # An empty bucket is not appended to: that would reopen the file and add
+    # an empty member to compressed outputs
+    def flush(self, tld_key):
+        if not self.buffers.get(tld_key):
+            return
+        output_file_path = os.path.join(self.result_folder, f"{tld_key}{self.suffix}")
+        if self.io is None:
+            self.io = stageio.BackgroundWriter(self.queue_depth)
+        wait = self.io.wait_seconds
+        self.io.submit(append_text, output_file_path, ''.join(self.buffers[tld_key]))
+        self.io_wait += self.io.wait_seconds - wait
+        self.buffers[tld_key] = []
+        self.buffered_bytes[tld_key] = 0
+        self.buffered_rows[tld_key] = 0
+
+    # Flush every bucket and wait until all of it is on disk. The writer can
+    # be used again afterwards.
+    def close(self):
+        for tld_key in list(self.buffers):
+            self.flush(tld_key)
+        if self.io is not None:
+            wait = self.io.wait_seconds
+            try:
+                self.io.close()
+            finally:
+                self.io_wait += self.io.wait_seconds - wait
+                self.io = None
+
+# Append to existing output, same as the row-by-row writer did. Each append
+# to a compressed output adds a new gzip member / xz stream / zstd frame.
+def append_text(output_file_path, text):
+    with stageio.open_text(output_file_path, 'a', newline='') as output_file:
+        output_file.write(text)
+
+# Per-TLD writer for columnar output. Arrow files cannot be appended to, so
+# one writer is kept per bucket for the whole run and written on close.
+class ColumnarTLDWriter:
+    columns = [('dns-name', stageio.STRING), ('first-seen', stageio.INT), ('last-seen', stageio.INT)]
+
+    def __init__(self, result_folder):
+        self.result_folder = result_folder
+        self.writers = {}
+
+    def write_frame(self, tld_key, frame):
+        if tld_key not in self.writers:
+            output_file_path = stageio.output_path(self.result_folder, tld_key, 'arrow')
+            self.writers[tld_key] = stageio.open_writer(output_file_path, self.columns)
+        # CSV inputs are read as text, so the epochs are converted here
+        self.writers[tld_key].write_columns([frame[name] if kind != stageio.INT
+                                             else pd.to_numeric(frame[name].replace('', None)).astype('Int64')
+                                             for name, kind in self.columns])
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+# Writer-like buffer that keeps the buckets of one byte range in a worker
+# process, to be replayed into the real writer in file order. CSV buckets are
+# rendered in the worker, so the parent only appends text.
+class RangeBuffer:
+    def __init__(self, render):
+        self.render = render
+        self.items = []
+
+    def write_frame(self, tld_key, frame):
+        if self.render:
+            self.items.append((tld_key, frame.to_csv(header=False, index=False), len(frame)))
         else:
-            tld_key = "others"
-
-        # Add the DNS name, first seen, and last seen to the corresponding DataFrame
-        if tld_key not in tld_dataframes:
-            tld_dataframes[tld_key] = pd.DataFrame(columns=['dns-name', 'first-seen', 'last-seen'])
-
-        # Remove TLD from the domain
-        domain_without_tld = dns_name[:dot_index] if dot_index != -1 else dns_name
-        tld_dataframes[tld_key] = pd.concat([tld_dataframes[tld_key], pd.DataFrame({'dns-name': [domain_without_tld], 'first-seen': [first_seen], 'last-seen': [last_seen]})], ignore_index=True)
-        
-        # Increment the processed rows counter
-        processed_rows += 1
-
-        # Append results after every 10 rows
-        if processed_rows % 10 == 0:
-            for tld_key, tld_df in tld_dataframes.items():
-                output_file_path = os.path.join(result_folder, f"{tld_key}.csv")
-                mode = 'a' if os.path.exists(output_file_path) else 'w'  # Use 'w' if file doesn't exist, 'a' if it does
-                tld_df.to_csv(output_file_path, mode=mode, header=False, index=False)
-                tld_dataframes[tld_key] = pd.DataFrame(columns=['dns-name', 'first-seen', 'last-seen'])  # Reset DataFrame after appending
-                print(f"I am running all fine ;)")
-
-    # Append any remaining results
-    for tld_key, tld_df in tld_dataframes.items():
-        output_file_path = os.path.join(result_folder, f"{tld_key}.csv")
-        mode = 'a' if os.path.exists(output_file_path) else 'w'  # Use 'w' if file doesn't exist, 'a' if it does
-        tld_df.to_csv(output_file_path, mode=mode, header=False, index=False)
-        
-    print(f"Processed {processed_rows} rows.")
-
-# Get user input for input and output directories
-input_directory = input("Enter the input directory path: ")
-output_directory = input("Enter the output directory path: ")
-
-# Process all CSV files in the specified input directory
-for filename in os.listdir(input_directory):
-    if filename.endswith(".csv"):
-        file_path = os.path.join(input_directory, filename)
-        process_csv(file_path, output_directory)
+            self.items.append((tld_key, frame, len(frame)))
+
+    def replay(self, writer):
+        for tld_key, value, rows in self.items:
+            if self.render:
+                writer.write(tld_key, value, rows)
+            else:
+                writer.write_frame(tld_key, value)
+
+# Read (dns-name, first-seen, last-seen) rows with every column as text, so
+# values are written back exactly as they came in. Inferred dtypes would
+# depend on the rows parsed together (one empty field turns a column into
+# floats), and so on how the file is split into chunks or ranges.
+def read_csv(source, **kwargs):
+    return pd.read_csv(source, header=None, dtype=str, keep_default_na=False, **kwargs)
+
+# Partition one newline-aligned byte range of a CSV file (runs in a worker)
+def partition_range(file_path, start, end, render):
+    buffer = RangeBuffer(render)
+    data = stageio.read_range(file_path, start, end)
+    rows = 0
+    if data.strip():
+        rows = partition_chunk(read_csv(io.BytesIO(data)), buffer)
+    return buffer, rows
+
+# Split a frame of (dns-name, first-seen, last-seen) rows into buckets by
+# ICANN suffix (dot_com, dot_co.uk, ...), removing the whole public suffix
+# from each name, so x.herokuapp.com is written as x to dot_com. Names with
+# no registrable label (the name is itself a public suffix) are kept whole in
+# "others".
+def partition_chunk(df, writer):
+    dns_names = df.iloc[:, 0].astype(str)
+
+    parts = suffixes.default_splitter().split_many(dns_names)
+    keys = ('dot_' + parts['bucket']).where(parts['label'].notna(), 'others')
+
+    out = pd.DataFrame({'dns-name': parts['rest'],
+                        'first-seen': df.iloc[:, 1],
+                        'last-seen': df.iloc[:, 2]})
+    for key, group in out.groupby(keys, sort=False):
+        writer.write_frame(key, group)
+    return len(df)
+
+# Function to process a CSV file. Pass a shared writer to collect several
+# input files into the same outputs (required for columnar output). CSV
+# outputs are flushed before returning, so what the file added to them is
+# recorded as its bytes_written; columnar outputs are only written when the
+# shared writer is closed and are not counted per file.
+# With workers > 1 an uncompressed CSV is split into newline-aligned byte
+# ranges of chunk_bytes that are partitioned in parallel and merged in file
+# order, so the outputs hold the same rows in the same order as a serial run.
+# Otherwise the file is streamed in chunks of chunk_size rows, up to
+# queue_depth of them read ahead on a background thread (chunk_size=None
+# reads the whole file at once).
+def process_csv(file_path, result_folder, chunk_size=1000000, flush_bytes=8 * 1024 * 1024, flush_rows=500000,
+                writer=None, workers=1, chunk_bytes=64 * 1024 * 1024, queue_depth=2):
+    if writer is None:
+        writer = TLDWriter(result_folder, flush_bytes=flush_bytes, flush_rows=flush_rows, queue_depth=queue_depth)
+    write_wait = getattr(writer, 'io_wait', 0.0)
+    appending = isinstance(writer, TLDWriter)
+
+    with recorder.file(file_path) as run:
+        if appending:
+            size_before = output_bytes(writer.result_folder)
+        if stageio.is_columnar(file_path):
+            rows = partition_chunk(stageio.read_table(file_path).to_pandas(), writer)
+            run.chunk(rows, rows)
+        elif workers > 1 and stageio.is_splittable(file_path):
+            for buffer, rows in stageio.map_ranges(partition_range, file_path, workers, chunk_bytes, appending):
+                buffer.replay(writer)
+                run.chunk(rows, rows)
+        elif chunk_size is None:
+            with stageio.open_text(file_path) as source:
+                rows = partition_chunk(read_csv(source), writer)
+            run.chunk(rows, rows)
+        else:
+            with stageio.open_text(file_path) as source, stageio.Prefetcher(
+                    read_csv(source, chunksize=chunk_size), depth=queue_depth) as chunks:
+                for chunk in chunks:
+                    rows = partition_chunk(chunk, writer)
+                    run.chunk(rows, rows)
+            run.io_wait += chunks.wait_seconds
+
+        if appending:
+            writer.close()
+            run.bytes_written = output_bytes(writer.result_folder) - size_before
+        run.io_wait += getattr(writer, 'io_wait', 0.0) - write_wait
+    return run.rows_in
+
+def is_output_file(filename):
+    return stageio.is_stage_file(filename) and (filename.startswith('dot_') or filename.startswith('others.'))
+
+def output_lengths(result_folder):
+    return {filename: os.path.getsize(os.path.join(result_folder, filename))
+            for filename in os.listdir(result_folder) if is_output_file(filename)}
+
+def output_bytes(result_folder):
+    return sum(output_lengths(result_folder).values())
+
+# Bring result_folder back to the state recorded in the journal: truncate each
+# output to its committed length and drop outputs the journal does not know,
+# discarding appends of a run that crashed half-way through an input file
+def rollback_outputs(result_folder, lengths):
+    for filename in os.listdir(result_folder):
+        if is_output_file(filename):
+            output_file_path = os.path.join(result_folder, filename)
+            if filename in lengths:
+                os.truncate(output_file_path, lengths[filename])
+            else:
+                os.remove(output_file_path)
+
+# Journaled inputs plus the inputs of this run, to be read again when the
+# outputs are rewritten. Inputs appended from other directories are read from
+# where they were; if one is gone, its rows cannot be rebuilt. Journal order
+# is kept, so a rebuild appends rows in the order they first came in.
+def journaled_sources(journal, input_paths, output_directory):
+    sources = {}
+    for path in journal['inputs']:
+        if path not in input_paths and not os.path.exists(path):
+            raise RuntimeError(f"Cannot rebuild {output_directory}: input {path} is gone; "
+                               f"rerun with incremental=False")
+        sources[path] = input_paths.get(path, path)
+    for path, input_path in input_paths.items():
+        sources.setdefault(path, input_path)
+    return sources
+
+# Every input file is appended to the shared dot_<tld>.csv outputs, so
+# several input directories can be fed into one output directory. The
+# manifest keeps a journal of the processed inputs (with fingerprints) and of
+# the output lengths after each one, so an incremental run only processes new
+# input files. Outputs already in the directory when the journal is started
+# (e.g. from runs before it existed) are adopted as its base and kept. If an
+# input of this directory changed or disappeared, its rows cannot be taken
+# back out: the outputs go back to the base and every journaled input is
+# appended again. incremental=False removes all outputs and starts over.
+def process_directory(input_directory, output_directory, output_format='csv', incremental=True, workers=1,
+                      chunk_size=1000000, queue_depth=2):
+    os.makedirs(output_directory, exist_ok=True)
+    run_manifest = manifest.Manifest(output_directory)
+    directory = os.path.abspath(input_directory)
+    input_paths = {os.path.abspath(os.path.join(input_directory, filename)): os.path.join(input_directory, filename)
+                   for filename in os.listdir(input_directory) if stageio.is_stage_file(filename)}
+
+    journal = run_manifest.data.get('appended')
+    if not incremental:
+        rollback_outputs(output_directory, {})
+    if not incremental or journal is None or journal.get('format') != output_format:
+        base = output_lengths(output_directory)
+        journal = {'inputs': {}, 'lengths': dict(base), 'base': base, 'format': output_format}
+    journal.setdefault('base', {})
+    run_manifest.data['appended'] = journal
+
+    # Journaled inputs of other directories are kept as they are
+    stale = [path for path, recorded in journal['inputs'].items()
+             if (path in input_paths and not manifest.unchanged(path, recorded))
+             or (path not in input_paths and os.path.dirname(path) == directory)]
+    if stale:
+        journal['inputs'] = {path: recorded for path, recorded in journal['inputs'].items()
+                             if path in input_paths or os.path.dirname(path) != directory}
+        sources = journaled_sources(journal, input_paths, output_directory)
+        rollback_outputs(output_directory, journal['base'])
+        journal['inputs'] = {}
+        journal['lengths'] = dict(journal['base'])
+    else:
+        sources = input_paths
+
+    pending = [path for path in sources if path not in journal['inputs']]
+    if not pending:
+        return
+    progress = metrics.Progress(recorder, len(pending), sum(os.path.getsize(path) for path in pending))
+
+    # Columnar files cannot be appended to, so any new input rewrites all outputs
+    if output_format == 'arrow':
+        sources = journaled_sources(journal, sources, output_directory)
+        if any(stageio.is_columnar(filename) for filename in journal['base']):
+            raise RuntimeError(f"{output_directory} holds columnar outputs of an earlier run that cannot be "
+                               f"merged; rerun with incremental=False")
+        rollback_outputs(output_directory, journal['base'])
+        writer = ColumnarTLDWriter(output_directory)
+        for path, input_path in sources.items():
+            process_csv(input_path, output_directory, writer=writer, workers=workers, chunk_size=chunk_size,
+                        queue_depth=queue_depth)
+            if path in pending:
+                progress.advance(os.path.getsize(path))
+        writer.close()
+        journal['inputs'] = {path: manifest.fingerprint(path) for path in sources}
+        journal['lengths'] = output_lengths(output_directory)
+        run_manifest.save()
+        progress.close()
+        return
+
+    rollback_outputs(output_directory, journal['lengths'])
+    writer = TLDWriter(output_directory, suffix=stageio.suffix_for(output_format), queue_depth=queue_depth)
+    for path in pending:
+        process_csv(sources[path], output_directory, writer=writer, workers=workers, chunk_size=chunk_size,
+                    queue_depth=queue_depth)
+        journal['lengths'] = output_lengths(output_directory)
+        journal['inputs'][path] = manifest.fingerprint(path)
+        run_manifest.save()
+        progress.advance(os.path.getsize(path))
+    progress.close()
+
+def main(output_format='csv', workers=os.cpu_count() or 1):
+    # Get user input for input and output directories
+    input_directory = input("Enter the input directory path: ")
+    output_directory = input("Enter the output directory path: ")
+
+    # Process all input files in the specified input directory
+    process_directory(input_directory, output_directory, output_format=output_format, workers=workers)
+
+if __name__ == "__main__":
+    main()
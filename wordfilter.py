@@ -1,15 +1,20 @@
 import os
-import csv
+import stageio
+from manifest import Manifest
+
+# Columns of the wordfiltered/ outputs
+COLUMNS = [('word', stageio.LABEL), ('freq', stageio.INT)]
+
+TARGET_WORDS = {"redpill", "incel", "mrp", "pua"}
 
 # Function to search for specific words in a CSV file and save them to a new file along with their frequencies
 def search_and_save_words(input_file_path, output_file_path, target_words):
     filtered_words = {}
-    with open(input_file_path, 'r', encoding='latin-1') as file:
-        reader = csv.reader(file)
+    with stageio.open_reader(input_file_path, encoding='latin-1') as reader:
         for row in reader:
             if row:
                 if len(row) >= 2:
-                    word = row[0].strip()
+                    word = str(row[0]).strip()
                     freq = int(row[1])
                     if word in target_words:
                         if word in filtered_words:
@@ -18,22 +23,37 @@ def search_and_save_words(input_file_path, output_file_path, target_words):
                             filtered_words[word] = freq
 
     if filtered_words:
-        with open(output_file_path, 'w') as file:
-            writer = csv.writer(file)
+        with stageio.open_writer(output_file_path, COLUMNS) as writer:
             for word, freq in filtered_words.items():
                 writer.writerow([word, freq])
+    return filtered_words
+
+# Search every file of input_dir; with incremental=True, files whose input and
+# target words are unchanged since the last run are skipped
+def process_files(input_dir, output_dir, target_words, output_format='csv', incremental=True):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(output_dir)
+    params = {'target_words': set(target_words)}
+    for filename in os.listdir(input_dir):
+        if stageio.is_stage_file(filename):
+            input_file_path = os.path.join(input_dir, filename)
+            output_file_path = stageio.output_path(output_dir, stageio.stem(filename), output_format)
+            if incremental and manifest.is_current(output_file_path, [input_file_path], params):
+                continue
+            # A stale output from an earlier word list must not survive an empty result
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)
+            filtered_words = search_and_save_words(input_file_path, output_file_path, target_words)
+            manifest.record(output_file_path, [input_file_path], params, produced=bool(filtered_words))
+            manifest.save()
 
 # Main function
 def main():
     input_dir = 'filtered_sorted/filtered'  # Directory containing input CSV files
     output_dir = 'wordfiltered'  # Directory to save word filter files
-    target_words = {"redpill", "incel", "mrp", "pua"}  # Words to search for
-    os.makedirs(output_dir, exist_ok=True)
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.csv'):
-            input_file_path = os.path.join(input_dir, filename)
-            output_file_path = os.path.join(output_dir, filename)
-            search_and_save_words(input_file_path, output_file_path, target_words)
+    target_words = TARGET_WORDS  # Words to search for
+    output_format = 'csv'  # or 'arrow' for columnar intermediates
+    process_files(input_dir, output_dir, target_words, output_format=output_format)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from collections import defaultdict
+import stageio
+import manifest
+import wordfilter
+
+# One-time inverted index over the filtered name,freq files of every TLD, so
+# new word lists do not need a pass over all files. postings maps a token to
+# the files (TLDs) it occurs in with its frequency there, plus its position
+# in the file so results come out in the same row order as wordfilter.py.
+# With ngrams, grams maps every character n-gram to the tokens containing it,
+# which narrows substring queries down to a few candidate tokens.
+NGRAM = 3
+
+class WordIndex:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS postings (token TEXT, source TEXT, freq INTEGER NOT NULL, "
+                          "position INTEGER NOT NULL, PRIMARY KEY (token, source)) WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_by_source ON postings (source)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS grams (gram TEXT, token TEXT, PRIMARY KEY (gram, token)) WITHOUT ROWID")
+        # Indexed files (stem -> fingerprint), so a rebuild only re-reads changed files
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, path TEXT, fingerprint TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def has_ngrams(self):
+        return self.get_meta('ngrams') == '1'
+
+    def sources(self):
+        return dict(self.conn.execute("SELECT source, path FROM sources"))
+
+    def is_current(self, source, path):
+        row = self.conn.execute("SELECT path, fingerprint FROM sources WHERE source = ?", (source,)).fetchone()
+        return (row is not None and row[0] == os.path.abspath(path)
+                and manifest.unchanged(path, json.loads(row[1])))
+
+    # Replace the postings of one file in a single transaction
+    def add_source(self, source, path, word_frequency):
+        with self.conn:
+            self.conn.execute("DELETE FROM postings WHERE source = ?", (source,))
+            self.conn.executemany("INSERT INTO postings (token, source, freq, position) VALUES (?, ?, ?, ?)",
+                                  ((word, source, freq, position)
+                                   for position, (word, freq) in enumerate(word_frequency.items())))
+            if self.has_ngrams():
+                self._add_grams(word_frequency)
+            self.conn.execute("INSERT OR REPLACE INTO sources (source, path, fingerprint) VALUES (?, ?, ?)",
+                              (source, os.path.abspath(path), json.dumps(manifest.fingerprint(path))))
+
+    def remove_source(self, source):
+        with self.conn:
+            self.conn.execute("DELETE FROM postings WHERE source = ?", (source,))
+            self.conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    def _add_grams(self, tokens):
+        self.conn.executemany("INSERT OR IGNORE INTO grams (gram, token) VALUES (?, ?)",
+                              ((gram, token) for token in tokens for gram in ngrams(token)))
+
+    # Build the n-gram postings for every indexed token (once), or drop grams
+    # of tokens that no longer occur in any file
+    def update_grams(self):
+        with self.conn:
+            if not self.has_ngrams():
+                self._add_grams(token for (token,) in self.conn.execute("SELECT DISTINCT token FROM postings"))
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ngrams', '1')")
+            else:
+                self.conn.execute("DELETE FROM grams WHERE token NOT IN (SELECT token FROM postings)")
+
+    # {source: [(word, freq), ...]} for exact words, rows in file order
+    def lookup(self, words):
+        return self._collect("SELECT source, token, freq, position FROM postings WHERE token = ?", set(words))
+
+    # {source: [(token, freq), ...]} for tokens containing any of substrings
+    def search(self, substrings):
+        return self._collect("SELECT source, token, freq, position FROM postings WHERE token = ?",
+                             self.matching_tokens(substrings))
+
+    def matching_tokens(self, substrings):
+        tokens = set()
+        for substring in set(substrings):
+            grams = ngrams(substring)
+            if self.has_ngrams() and len(substring) >= NGRAM:
+                candidates = None
+                for gram in grams:
+                    found = {token for (token,) in self.conn.execute("SELECT token FROM grams WHERE gram = ?", (gram,))}
+                    candidates = found if candidates is None else candidates & found
+                    if not candidates:
+                        break
+                tokens.update(token for token in candidates if substring in token)
+            else:
+                tokens.update(token for (token,) in self.conn.execute(
+                    "SELECT DISTINCT token FROM postings WHERE instr(token, ?) > 0", (substring,)))
+        return tokens
+
+    def _collect(self, query, tokens):
+        hits = defaultdict(list)
+        for token in tokens:
+            for source, token, freq, position in self.conn.execute(query, (token,)):
+                hits[source].append((position, token, freq))
+        return {source: [(token, freq) for position, token, freq in sorted(rows)] for source, rows in hits.items()}
+
+def ngrams(token, n=NGRAM):
+    return {token[i:i + n] for i in range(len(token) - n + 1)}
+
+# word -> summed freq of one filtered file, in first-seen order, read the way
+# wordfilter.search_and_save_words reads it
+def read_word_frequency(input_file_path):
+    word_frequency = {}
+    with stageio.open_reader(input_file_path, encoding='latin-1') as reader:
+        for row in reader:
+            if row and len(row) >= 2:
+                word = str(row[0]).strip()
+                word_frequency[word] = word_frequency.get(word, 0) + int(row[1])
+    return word_frequency
+
+# Index every file of input_dir. Unchanged files are skipped and files that
+# disappeared are dropped, so re-running after new snapshots is cheap.
+def build_index(input_dir, index_path, with_ngrams=False):
+    with WordIndex(index_path) as index:
+        present = set()
+        for filename in os.listdir(input_dir):
+            if stageio.is_stage_file(filename):
+                input_file_path = os.path.join(input_dir, filename)
+                source = stageio.stem(filename)
+                present.add(source)
+                if not index.is_current(source, input_file_path):
+                    index.add_source(source, input_file_path, read_word_frequency(input_file_path))
+        for source in set(index.sources()) - present:
+            index.remove_source(source)
+        if with_ngrams or index.has_ngrams():
+            index.update_grams()
+
+# Write one wordfilter-shaped word,freq file per TLD with hits and remove
+# stale outputs of TLDs without any
+def write_results(index, hits, output_dir, output_format='csv'):
+    os.makedirs(output_dir, exist_ok=True)
+    for source in index.sources():
+        output_file_path = stageio.output_path(output_dir, source, output_format)
+        if source in hits:
+            with stageio.open_writer(output_file_path, wordfilter.COLUMNS) as writer:
+                writer.writerows(hits[source])
+        elif os.path.exists(output_file_path):
+            os.remove(output_file_path)
+
+# Exact words give the same files as wordfilter.process_files; with
+# substrings=True every token containing one of the words is reported
+def query(index_path, words, output_dir=None, substrings=False, output_format='csv'):
+    with WordIndex(index_path) as index:
+        hits = index.search(words) if substrings else index.lookup(words)
+        if output_dir is not None:
+            write_results(index, hits, output_dir, output_format)
+    return hits
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the word index of the filtered name counts.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="index the name,freq files of a directory")
+    build.add_argument('input_dir', nargs='?', default='filtered_sorted/filtered')
+    build.add_argument('--index', default='wordindex.sqlite')
+    build.add_argument('--ngrams', action='store_true', help="also build n-gram postings for substring queries")
+    search = commands.add_parser('query', help="per-TLD counts of words (or substrings)")
+    search.add_argument('words', nargs='*', help="default: wordfilter.TARGET_WORDS")
+    search.add_argument('--index', default='wordindex.sqlite')
+    search.add_argument('--output-dir', help="write word,freq files per TLD here (like wordfilter.py)")
+    search.add_argument('--output-format', default='csv')
+    search.add_argument('--substring', action='store_true', help="match tokens containing the words")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index(args.input_dir, args.index, with_ngrams=args.ngrams)
+        return
+    if not os.path.exists(args.index):
+        sys.exit(f"No index at {args.index}; run 'python wordindex.py build' first")
+    hits = query(args.index, args.words or wordfilter.TARGET_WORDS, args.output_dir, args.substring,
+                 args.output_format)
+    for source, rows in sorted(hits.items()):
+        for word, freq in rows:
+            print(f"{source},{word},{freq}")
+
+if __name__ == "__main__":
+    main()